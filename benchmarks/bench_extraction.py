@@ -0,0 +1,153 @@
+"""Benchmark of the time series extraction stage on a synthetic workload of monthly GRACE-like
+rasters (global 0.5 degree grid) sampled at random sites, 20 years and 1000 sites by default.
+
+The accumulation part needs only numpy and pandas. It compares the old loop, which walked
+every calendar day and grew the results frame one row at a time (DataFrame.append, removed
+in pandas 2, so the equivalent one-row concat is timed), with the current approach, which
+only visits the dates that have a raster, fills one sites x dates matrix and builds the
+frames once. Pixel reads are simulated by indexing an in-memory raster, so only the
+accumulation cost differs between the two.
+
+With GDAL installed, the real time_series_aoi.extract_aois (without the extraction cache,
+then with it cold and warm) and write_time_series are also timed on GeoTIFFs on disk.
+
+Measured with the defaults (Python 3.11, pandas 3.0, numpy 2.4, no GDAL):
+    7305 days, 240 rasters, 1000 sites
+    before: per-day one-row frame growth     5.13 s
+    after:  one matrix, frames built once    0.01 s
+
+Run with: python benchmarks/bench_extraction.py [N_YEARS] [N_SITES]"""
+
+import os
+import sys
+import time
+import tempfile
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+START_YEAR = 2002
+GT = (-180.0, 0.5, 0.0, 90.0, 0.0, -0.5)
+SHAPE = (360, 720)
+
+
+def month_keys(n_years):
+    # yyyyddd key of the first day of every month, one raster each
+    return [datetime(year, month, 1).strftime('%Y%j')
+            for year in range(START_YEAR, START_YEAR + n_years) for month in range(1, 13)]
+
+
+def day_keys(n_years):
+    days = pd.date_range(datetime(START_YEAR, 1, 1), datetime(START_YEAR + n_years - 1, 12, 31))
+    return list(days.strftime('%Y%j'))
+
+
+def site_pixels(n_sites, rng):
+    return rng.integers(0, SHAPE[0], n_sites), rng.integers(0, SHAPE[1], n_sites)
+
+
+def read_sites(raster, file_idx, rows, cols):
+    # stands in for extract_site_values: one value per site, different for every raster
+    return raster[rows, cols] + file_idx
+
+
+def before(n_years, raster, rows, cols):
+    # the old make_time_series_plots loop: every calendar day is looked up and the AOI mean
+    # appended as a new row, copying the whole frame each time
+    files = {key: i for i, key in enumerate(month_keys(n_years))}
+    df = pd.DataFrame(columns=['yyyyddd', 'value'])
+    for key in day_keys(n_years):
+        value = np.nan
+        if key in files:
+            pixel_values = read_sites(raster, files[key], rows, cols)
+            value = pixel_values[~np.isnan(pixel_values)].mean()
+        df = pd.concat([df, pd.DataFrame([{'yyyyddd': key, 'value': value}])], ignore_index=True)
+    df['date'] = pd.to_datetime(df['yyyyddd'], format='%Y%j')
+    return df.set_index('date').drop(columns=['yyyyddd']).groupby('date').mean()
+
+
+def after(n_years, raster, rows, cols):
+    # extract_aois and write_time_series: only the dates with a raster, one column each
+    date_keys = month_keys(n_years)
+    site_matrix = np.full((rows.size, len(date_keys)), np.nan)
+    for i in range(len(date_keys)):
+        site_matrix[:, i] = read_sites(raster, i, rows, cols)
+    dates = pd.to_datetime(date_keys, format='%Y%j')
+    mean_df = pd.DataFrame({'value': np.nanmean(site_matrix, axis=0)}, index=dates)
+    sites_df = pd.DataFrame(site_matrix.T, index=dates, columns=[str(i) for i in range(rows.size)])
+    return mean_df, sites_df
+
+
+def make_workspace(ws_dir, n_years, n_sites, rng):
+    # one GeoTIFF per month and a sample csv of random sites
+    from osgeo import gdal, osr
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    driver = gdal.GetDriverByName('GTiff')
+    for year in range(START_YEAR, START_YEAR + n_years):
+        for month in range(1, 13):
+            first = datetime(year, month, 1)
+            last = datetime(year + month // 12, month % 12 + 1, 1)
+            name = 'GRD-3_{a}-{b}_GRAC_JPLEM_BA01_0600_LND_v03.tif'.format(
+                a=first.strftime('%Y%j'), b=(last - timedelta(days=1)).strftime('%Y%j'))
+            ds = driver.Create(os.path.join(ws_dir, name), SHAPE[1], SHAPE[0], 1, gdal.GDT_Float32)
+            ds.SetGeoTransform(GT)
+            ds.SetProjection(srs.ExportToWkt())
+            ds.GetRasterBand(1).WriteArray(rng.normal(0, 10, SHAPE).astype(np.float32))
+            ds = None
+
+    lats = rng.uniform(-60, 70, n_sites)
+    lons = rng.uniform(-180, 180, n_sites)
+    with open(os.path.join(ws_dir, 'sites.csv'), 'w') as f:
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            f.write(f'{i},{lat},{lon}\n')
+    return lats, lons
+
+
+def bench_gdal(n_years, n_sites):
+    import matplotlib
+    matplotlib.use('Agg')
+    from grace import time_series_aoi
+
+    start = datetime(START_YEAR, 1, 1)
+    end = datetime(START_YEAR + n_years - 1, 12, 31)
+    with tempfile.TemporaryDirectory() as ws_dir:
+        lats, lons = make_workspace(ws_dir, n_years, n_sites, np.random.default_rng(0))
+        timed('extract_aois, no cache', time_series_aoi.extract_aois, ws_dir, 'GRD-3', start, end,
+              [(lats, lons)], use_cache=False)
+        timed('extract_aois, cold cache', time_series_aoi.extract_aois, ws_dir, 'GRD-3', start, end,
+              [(lats, lons)])
+        date_keys, site_matrices = timed('extract_aois, warm cache', time_series_aoi.extract_aois,
+                                         ws_dir, 'GRD-3', start, end, [(lats, lons)])
+        timed('write_time_series', time_series_aoi.write_time_series, ws_dir, 'GRD-3', start, end,
+              'sites.csv', [str(i) for i in range(n_sites)], date_keys, site_matrices[0])
+
+
+def timed(label, fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    print(f'{label:<40} {time.perf_counter() - t0:8.2f} s')
+    return result
+
+
+if __name__ == '__main__':
+    n_years = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_sites = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    rng = np.random.default_rng(0)
+    raster = rng.normal(0, 10, SHAPE)
+    rows, cols = site_pixels(n_sites, rng)
+    print(f'{len(day_keys(n_years))} days, {n_years * 12} rasters, {n_sites} sites')
+    old_df = timed('before: per-day one-row frame growth', before, n_years, raster, rows, cols)
+    new_df, sites_df = timed('after:  one matrix, frames built once', after, n_years, raster, rows, cols)
+    # same AOI means on the dates that have a raster
+    assert np.allclose(old_df['value'].dropna().to_numpy(), new_df['value'].to_numpy())
+
+    try:
+        import osgeo
+    except ImportError:
+        print('GDAL not installed, skipping the extract_aois/write_time_series timings')
+    else:
+        bench_gdal(n_years, n_sites)
@@ -1,4 +1,7 @@
+from multiprocessing import freeze_support
 from grace.__main__ import main
 
 if __name__ == '__main__':
+	# frozen builds must not re-launch the GUI in every render worker process
+	freeze_support()
 	main()
@@ -1,32 +1,35 @@
 """This is a simple GUI frontend to run the spatial/temporal analysis tools for GRACE
-Tellus groundwater anomaly data.
+Tellus groundwater anomaly data. Run with arguments (python -m grace run job.yaml, or
+python -m grace --help) it is a headless command line instead, see cli.py.
 Author: Arthur Elmes
 2021-05-28"""
 
-import PySimpleGUI as sg
 import os.path
 from datetime import datetime
 import sys
 
-# modules in this package
-from grace import time_series_aoi
-from grace import download_grace
-from grace import viz_grace
-from grace import img_diff
+# modules in this package are imported where they are used, so that the headless
+# command line only loads the heavy libraries (GDAL, Basemap, matplotlib) it needs
 
 
 # example gui from https://github.com/PySimpleGUI/PySimpleGUI/blob/master/DemoPrograms/Demo_Button_Func_Calls.py
-def run_download(start, end, dl_dir):
+def run_download(start, end, dl_dir, progress=None):
+    from grace import download_grace
+    from grace import data_cube
     print('Now downloading GRACE images for time period.')
-    download_grace.dl_data(dl_dir, start, end)
+    download_grace.dl_data(dl_dir, start, end, progress=progress)
+    # consolidate the workspace into the data cube the analyses below read from
+    data_cube.build_cube(dl_dir)
 
 
-def run_vis(ul, lr, workspace):
+def run_vis(ul, lr, workspace, progress=None):
+    from grace import viz_grace
     print('Now creating map of AOI.')
-    viz_grace.make_all_plots(workspace, ul, lr)
+    viz_grace.make_all_plots(workspace, ul, lr, use_cube=True, progress=progress)
 
 
-def run_plots(start, end, csv, workspace):
+def run_plots(start, end, csv, workspace, progress=None):
+    from grace import time_series_aoi
     print('Now creating time series plots for AOI.')
     # for these graphs, must have full year of data
     if start.month != 1:
@@ -38,18 +41,33 @@ def run_plots(start, end, csv, workspace):
                                            prdct='GRD-3',
                                            start_date=start,
                                            end_date=end,
-                                           csv_name=csv)
+                                           csv_name=csv,
+                                           use_cube=True,
+                                           progress=progress)
 
 
-def make_img_diff(start, end, ul, lr, workspace):
+def make_img_diff(start, end, ul, lr, workspace, progress=None):
+    from grace import img_diff
     print('Now creating image difference map for AOI.')
     try:
-        img_diff.run_img_diff(start, end, ul, lr, workspace)
+        img_diff.run_img_diff(start, end, ul, lr, workspace, use_cube=True, progress=progress)
     except IndexError:
         print('File(s) not found -- make sure you have a file for this date!')
 
 
 def main():
+    # any arguments mean a headless run
+    if len(sys.argv) > 1:
+        from grace import cli
+        cli.main(sys.argv[1:])
+        return
+
+    import PySimpleGUI as sg
+    # jobs render from worker threads, which must never touch a GUI matplotlib backend
+    import matplotlib
+    matplotlib.use('Agg')
+    from grace import jobs
+
     # # example gui from https://github.com/PySimpleGUI/PySimpleGUI/blob/master/DemoPrograms/Demo_Button_Func_Calls.py
 
     # set theme
@@ -87,6 +105,9 @@ def main():
                          sg.Button('Create AOI Maps', key='-Map-', font=('Lucinda', 14)),
                          sg.Button('Time Series Graphs', key='-Time-', font=('Lucinda', 14)),
                          sg.Button('MakeImage Difference', key='-ImDiff-', font=('Lucinda', 14))],
+                        [sg.Text('Jobs (run in the background, several at once):', font=('Lucinda', 14))],
+                        [sg.Listbox(values=[], size=(70, 6), key='-JOBS-', font=('Lucinda', 12))],
+                        [sg.Button('Cancel Selected Job', key='-Cancel-', font=('Lucinda', 14))],
                       ]
 
     file_list_col = [
@@ -119,6 +140,8 @@ def main():
     ]
     # make the window obj
     window = sg.Window('GRACE Data eXplorer Beta', layout)
+    # long jobs go to background workers so the event loop below never blocks
+    scheduler = jobs.JobScheduler(window)
     # base_dir = '/home/arthur/Dropbox/career/e84/sample_data/'
     # the event loop
     while True:
@@ -126,16 +149,23 @@ def main():
         if event == sg.WIN_CLOSED:
             break
         elif event == '-Download-':
-            run_download(date_start, date_end, base_dir)
+            scheduler.submit('Download', run_download, date_start, date_end, base_dir)
             print(base_dir)
         elif event == '-Map-':
-            run_vis(ul_coord, lr_coord, base_dir)
+            scheduler.submit('AOI maps', run_vis, ul_coord, lr_coord, base_dir, plots=True)
         elif event == '-Time-':
-            run_plots(date_start, date_end, sample_csv, base_dir)
+            scheduler.submit('Time series', run_plots, date_start, date_end, sample_csv, base_dir, plots=True)
         elif event == '-ImDiff-':
-            date_start_doy = download_grace.convert_date(date_start)
-            date_end_doy = download_grace.convert_date(date_end)
-            make_img_diff(date_start_doy, date_end_doy, ul_coord, lr_coord, base_dir)
+            date_start_doy = datetime.strftime(date_start, '%Y%j')
+            date_end_doy = datetime.strftime(date_end, '%Y%j')
+            scheduler.submit('Image difference', make_img_diff, date_start_doy, date_end_doy,
+                             ul_coord, lr_coord, base_dir, plots=True)
+        elif event == jobs.JOB_EVENT:
+            # a job changed state or reported progress
+            window['-JOBS-'].update(scheduler.status_lines())
+        elif event == '-Cancel-':
+            if values['-JOBS-']:
+                scheduler.cancel(int(values['-JOBS-'][0].split(':')[0]))
         elif event == '-Submit-':
             date_start = datetime.strptime(values['-StartDate-'], '%Y-%m-%d')
             date_end = datetime.strptime(values['-EndDate-'], '%Y-%m-%d')
@@ -167,9 +197,12 @@ def main():
             except:
                 pass
 
+    scheduler.shutdown()
     window.close()
 
 
 if __name__ == '__main__':
+	from multiprocessing import freeze_support
+	freeze_support()
 	main()
 
@@ -0,0 +1,238 @@
+"""Headless command line interface to the GRACE Data eXplorer, for running on servers
+without the PySimpleGUI frontend. Each subcommand imports only the modules it needs, so
+e.g. a download never loads matplotlib, Basemap or GDAL.
+
+    python -m grace download --workspace DIR --start 2002-01-01 --end 2020-12-01
+    python -m grace map --workspace DIR --ul -10 100 --lr -45 160
+    python -m grace timeseries --workspace DIR --start 2002-01-01 --end 2018-12-31 --csv AliceSprings.csv
+    python -m grace diff --workspace DIR --ul -10 100 --lr -45 160 --start 2010-06-01 --end 2010-08-01
+    python -m grace pipeline --workspace DIR --start 2002-01-01 --end 2020-12-01 --box -10 100 -45 160 --csv AliceSprings.csv
+    python -m grace run job.yaml
+
+A job file holds one job, or a list of them under 'jobs', each with a 'task' (one of the
+subcommands) and the same options as the command line, e.g.
+    {"jobs": [{"task": "download", "workspace": "/data/grace", "start": "2002-01-01", "end": "2020-12-01"},
+              {"task": "timeseries", "workspace": "/data/grace", "start": "2002-01-01",
+               "end": "2018-12-31", "csv": ["AliceSprings.csv"]}]}
+Job files are json or yaml."""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+
+def parse_date(date_str):
+    return datetime.strptime(date_str, '%Y-%m-%d')
+
+
+def parse_coord(coord_str):
+    # keep whole-degree coords as ints so output names match the ones the GUI makes
+    coord = float(coord_str)
+    return int(coord) if coord.is_integer() else coord
+
+
+def full_years(start, end):
+    # for the time series graphs, must have full year of data
+    start = datetime(start.year, 1, 1)
+    end = datetime(end.year, 12, 31)
+    return start, end
+
+
+def run_download(args):
+    from grace import download_grace
+    download_grace.dl_data(args.workspace, parse_date(args.start), parse_date(args.end),
+                           max_workers=args.workers or download_grace.MAX_WORKERS, sync=args.sync,
+                           revalidate=args.revalidate)
+    if args.cube:
+        from grace import data_cube
+        data_cube.build_cube(args.workspace)
+
+
+def run_map(args):
+    from grace import viz_grace
+    viz_grace.make_all_plots(args.workspace, tuple(args.ul), tuple(args.lr),
+                             max_workers=args.workers,
+                             in_memory=args.in_memory,
+                             use_cube=args.use_cube,
+                             dynamic_stretch=args.dynamic_stretch,
+                             out_format=args.format,
+                             scale=args.scale,
+                             reuse_palette=args.reuse_palette)
+
+
+def run_timeseries(args):
+    from grace import time_series_aoi
+    start, end = full_years(parse_date(args.start), parse_date(args.end))
+    time_series_aoi.make_time_series_batch(args.workspace, args.prdct, start, end, args.csv,
+                                           max_workers=args.workers, use_cube=args.use_cube,
+                                           use_cache=not args.no_cache, columnar=args.columnar)
+
+
+def run_diff(args):
+    from grace import img_diff
+    if args.rule is not None:
+        img_diff.run_img_diff_batch(args.workspace, tuple(args.ul), tuple(args.lr), rule=args.rule,
+                                    max_workers=args.workers, use_cube=args.use_cube,
+                                    dynamic_stretch=args.dynamic_stretch)
+        return
+    if args.start is None or args.end is None:
+        raise SystemExit('diff needs --start and --end, or --rule')
+    start = parse_date(args.start).strftime('%Y%j')
+    end = parse_date(args.end).strftime('%Y%j')
+    try:
+        img_diff.run_img_diff(start, end, tuple(args.ul), tuple(args.lr), args.workspace,
+                              use_cube=args.use_cube, dynamic_stretch=args.dynamic_stretch)
+    except IndexError:
+        print('File(s) not found -- make sure you have a file for this date!')
+
+
+def run_pipeline(args):
+    from grace import pipeline
+    boxes = [((box[0], box[1]), (box[2], box[3])) for box in args.box or []]
+    pipeline.run_pipeline(args.workspace, parse_date(args.start), parse_date(args.end),
+                          aoi_boxes=boxes, csv_names=args.csv or [], prdct=args.prdct,
+                          sync=not args.full, max_workers=args.workers)
+    if args.cube:
+        from grace import data_cube
+        data_cube.build_cube(args.workspace, args.prdct)
+
+
+TASKS = {'download': run_download, 'map': run_map, 'timeseries': run_timeseries, 'diff': run_diff,
+         'pipeline': run_pipeline}
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='python -m grace',
+                                     description='Run GRACE Data eXplorer jobs without the GUI.')
+    subparsers = parser.add_subparsers(dest='task', required=True)
+
+    def add_common(sub):
+        sub.add_argument('--workspace', required=True, help='directory holding the GRACE tifs')
+        sub.add_argument('--workers', type=int, default=None, help='parallel workers (default: all cores)')
+
+    def add_aoi(sub):
+        sub.add_argument('--ul', type=parse_coord, nargs=2, required=True, metavar=('LAT', 'LON'),
+                         help='upper left corner, e.g. 60 -120 for 60N 120W')
+        sub.add_argument('--lr', type=parse_coord, nargs=2, required=True, metavar=('LAT', 'LON'),
+                         help='lower right corner')
+        sub.add_argument('--use-cube', action='store_true', help='read from the workspace data cube')
+        sub.add_argument('--dynamic-stretch', action='store_true',
+                         help='colour stretch from the statistics of the whole AOI stack')
+
+    sub = subparsers.add_parser('download', help='download GRACE/GRACE-FO tiles')
+    add_common(sub)
+    sub.add_argument('--start', required=True, help='YYYY-MM-DD')
+    sub.add_argument('--end', required=True, help='YYYY-MM-DD')
+    sub.add_argument('--sync', action='store_true', help='incremental sync instead of a full download')
+    sub.add_argument('--revalidate', action='store_true',
+                     help='with --sync, re-check complete and missing months against the server')
+    sub.add_argument('--cube', action='store_true', help='build the data cube after downloading')
+
+    sub = subparsers.add_parser('map', help='render AOI maps and the animation')
+    add_common(sub)
+    add_aoi(sub)
+    sub.add_argument('--in-memory', action='store_true', help='animate without re-reading the PNGs')
+    sub.add_argument('--format', choices=['gif', 'mp4', 'webm'], default='gif',
+                     help='animation format (mp4/webm need imageio-ffmpeg)')
+    sub.add_argument('--scale', type=float, default=1.0, help='scale the animation frames by this factor')
+    sub.add_argument('--reuse-palette', action='store_true',
+                     help='quantize every gif frame to the palette of the first one')
+
+    sub = subparsers.add_parser('timeseries', help='time series csvs and graphs for AOI sample csvs')
+    add_common(sub)
+    sub.add_argument('--start', required=True, help='YYYY-MM-DD')
+    sub.add_argument('--end', required=True, help='YYYY-MM-DD')
+    sub.add_argument('--csv', nargs='+', required=True, help='sample csv(s), id,lat,lon with no headers')
+    sub.add_argument('--prdct', default='GRD-3')
+    sub.add_argument('--use-cube', action='store_true', help='read from the workspace data cube')
+    sub.add_argument('--no-cache', action='store_true', help='re-extract every raster, ignoring the extraction cache')
+    sub.add_argument('--columnar', choices=['parquet', 'feather'],
+                     help='also write the per site values in this format (needs pyarrow)')
+
+    sub = subparsers.add_parser('diff', help='image difference maps')
+    add_common(sub)
+    add_aoi(sub)
+    sub.add_argument('--start', help='YYYY-MM-DD of the earlier image')
+    sub.add_argument('--end', help='YYYY-MM-DD of the later image')
+    sub.add_argument('--rule', choices=['month', 'year'],
+                     help='difference every month against the previous month/year instead')
+
+    sub = subparsers.add_parser('pipeline', help='download, sample and render each tile as it arrives')
+    add_common(sub)
+    sub.add_argument('--start', required=True, help='YYYY-MM-DD')
+    sub.add_argument('--end', required=True, help='YYYY-MM-DD')
+    sub.add_argument('--box', type=parse_coord, nargs=4, action='append', metavar=('UL_LAT', 'UL_LON', 'LR_LAT', 'LR_LON'),
+                     help='AOI to render, may be given more than once')
+    sub.add_argument('--csv', nargs='+', help='sample csv(s), id,lat,lon with no headers')
+    sub.add_argument('--prdct', default='GRD-3')
+    sub.add_argument('--full', action='store_true', help='full download instead of an incremental sync')
+    sub.add_argument('--cube', action='store_true', help='build the data cube once the stream ends')
+
+    sub = subparsers.add_parser('run', help='run the jobs in a json/yaml job file')
+    sub.add_argument('job_file')
+
+    return parser
+
+
+def read_job_file(job_file):
+    with open(job_file, 'r') as f:
+        text = f.read()
+    if os.path.splitext(job_file)[1].lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise SystemExit('PyYAML is needed for yaml job files, or use json')
+        spec = yaml.safe_load(text)
+    else:
+        spec = json.loads(text)
+
+    if isinstance(spec, dict) and 'jobs' in spec:
+        return spec['jobs']
+    return spec if isinstance(spec, list) else [spec]
+
+
+def job_to_argv(job):
+    # turn a job mapping back into command line arguments, so job files and the command
+    # line go through the same parser and defaults
+    job = dict(job)
+    argv = [job.pop('task')]
+    for key, value in job.items():
+        flag = '--' + key.replace('_', '-')
+        if isinstance(value, bool):
+            if value:
+                argv.append(flag)
+        elif isinstance(value, (list, tuple)) and value and isinstance(value[0], (list, tuple)):
+            # repeated option, e.g. several --box
+            for item in value:
+                argv.append(flag)
+                argv.extend(str(v) for v in item)
+        elif isinstance(value, (list, tuple)):
+            argv.append(flag)
+            argv.extend(str(v) for v in value)
+        elif value is not None:
+            argv.extend([flag, str(value)])
+    return argv
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+
+    if args.task == 'run':
+        jobs = read_job_file(args.job_file)
+        # checked up front, before any job runs
+        if any(job.get('task') == 'run' for job in jobs):
+            raise SystemExit('job files cannot run other job files')
+        for job in jobs:
+            job_args = parser.parse_args(job_to_argv(job))
+            print(f'running {job_args.task} job')
+            TASKS[job_args.task](job_args)
+        return
+
+    TASKS[args.task](args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
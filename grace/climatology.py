@@ -0,0 +1,100 @@
+"""This module reshapes time series into day-of-year (or month) x year matrices and computes
+climatologies and anomalies from them with NumPy reductions, for any number of sites at
+once. Values come in as (..., dates) arrays with their yyyyddd keys, e.g. one series or a
+sites x dates matrix, and every result keeps the leading dimensions.
+Leap years are aligned on the calendar rather than truncated: the matrix has 366 days and
+in common years the Feb 29 slot is left empty, so e.g. Mar 1 is always the same row."""
+
+import numpy as np
+import pandas as pd
+
+DAYS = 366
+MONTHS = 12
+PERCENTILES = (10, 50, 90)
+
+
+def doy_positions(date_keys):
+    # year and leap-aligned day row (0-365) of every yyyyddd key
+    dates = pd.to_datetime(list(date_keys), format='%Y%j')
+    doy = np.asarray(dates.dayofyear)
+    common = ~np.asarray(dates.is_leap_year)
+    return np.asarray(dates.year), doy - 1 + (common & (doy >= 60))
+
+
+def month_positions(date_keys):
+    dates = pd.to_datetime(list(date_keys), format='%Y%j')
+    return np.asarray(dates.year), np.asarray(dates.month) - 1
+
+
+def to_matrix(values, years, rows, n_rows):
+    # scatter (..., dates) values into a (..., n_rows, years) matrix in one assignment;
+    # returns the matrix and the years of its columns. Two dates falling in the same
+    # slot (e.g. two tiles in one month) keep the later one.
+    values = np.asarray(values, dtype=np.float64)
+    col_years, cols = np.unique(years, return_inverse=True)
+    matrix = np.full(values.shape[:-1] + (n_rows, col_years.size), np.nan)
+    matrix[..., rows, cols] = values
+    return matrix, col_years
+
+
+def doy_year_matrix(date_keys, values):
+    years, rows = doy_positions(date_keys)
+    return to_matrix(values, years, rows, DAYS)
+
+
+def month_year_matrix(date_keys, values):
+    years, rows = month_positions(date_keys)
+    return to_matrix(values, years, rows, MONTHS)
+
+
+def climatology(matrix, percentiles=PERCENTILES):
+    # statistics over the years (last axis) of a doy/month x year matrix, NaN ignored.
+    # Rows without any data come out NaN with count 0.
+    count = np.sum(np.isfinite(matrix), axis=-1)
+    has_data = count > 0
+    clim = {'count': count}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = np.nansum(matrix, axis=-1)
+        clim['mean'] = np.where(has_data, total / np.maximum(count, 1), np.nan)
+        sq_dev = np.nansum((matrix - clim['mean'][..., None]) ** 2, axis=-1)
+        clim['std'] = np.where(has_data, np.sqrt(sq_dev / np.maximum(count, 1)), np.nan)
+    # nanpercentile warns on all-NaN rows; fill them with a dummy value and mask after
+    filled = np.where(has_data[..., None], matrix, 0.0)
+    for q in percentiles:
+        clim[f'p{q}'] = np.where(has_data, np.nanpercentile(filled, q, axis=-1), np.nan)
+    clim['min'] = np.where(has_data, np.nanmin(filled, axis=-1), np.nan)
+    clim['max'] = np.where(has_data, np.nanmax(filled, axis=-1), np.nan)
+    return clim
+
+
+def anomaly(matrix, clim):
+    # departure of every value from the climatological mean of its row
+    return matrix - clim['mean'][..., None]
+
+
+def series_anomaly(date_keys, values, by='month'):
+    # anomaly of a (..., dates) series against its own monthly (or day of year) climatology,
+    # returned in the same (..., dates) layout as values
+    if by == 'month':
+        years, rows = month_positions(date_keys)
+        n_rows = MONTHS
+    else:
+        years, rows = doy_positions(date_keys)
+        n_rows = DAYS
+    matrix, col_years = to_matrix(values, years, rows, n_rows)
+    clim = climatology(matrix, percentiles=())
+    return np.asarray(values, dtype=np.float64) - clim['mean'][..., rows]
+
+
+def years_frame(date_keys, values):
+    # DOY x year DataFrame of a single series, with string year columns, for the plots
+    matrix, col_years = doy_year_matrix(date_keys, values)
+    years_df = pd.DataFrame(matrix, index=np.arange(1, DAYS + 1), columns=col_years.astype(str))
+    years_df.index.name = 'doy'
+    # drop any years that have no data at all
+    return years_df.dropna(axis=1, how='all')
+
+
+def climatology_frame(clim, index):
+    # one row per doy/month, one column per statistic, for a single series
+    return pd.DataFrame({name: clim[name] for name in clim}, index=index)
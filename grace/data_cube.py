@@ -0,0 +1,188 @@
+"""This module consolidates the monthly GRACE GeoTIFFs in a workspace into a single
+time x lat x lon data cube, so that analyses read one memory-mapped array instead of
+reopening hundreds of small files through GDAL. The cube is a raw .npy file plus a
+small json index holding the time coordinate, source files and georeferencing."""
+
+import os
+import gc
+import json
+import numpy as np
+from osgeo import gdal
+
+# modules in this package
+from grace import workspace_index
+
+CUBE_DIR = 'cube'
+NODATA = -99999.0
+
+# cubes already opened by this process, keyed by cube path; None for a cube found stale
+CUBE_CACHE = {}
+
+
+def cube_paths(base_dir, prdct='GRD-3'):
+    cube_dir = os.path.join(base_dir, CUBE_DIR)
+    return os.path.join(cube_dir, prdct + '_cube.npy'), os.path.join(cube_dir, prdct + '_cube.json')
+
+
+def workspace_files(base_dir, prdct='GRD-3'):
+    # yyyyddd keys and names of the prdct rasters in the workspace, one per date, in date order
+    index = workspace_index.build_index(base_dir)
+
+    date_keys = []
+    file_names = []
+    for date_key in sorted(index):
+        matches = [f for f in index[date_key] if f.startswith(prdct) and f.endswith('.tif')]
+        if len(matches) > 1:
+            print(f'Multiple matching files found for {date_key}, using {matches[0]}')
+        if matches:
+            date_keys.append(date_key)
+            file_names.append(matches[0])
+    return date_keys, file_names
+
+
+def build_cube(base_dir, prdct='GRD-3'):
+    # stack every prdct raster in the workspace, in date order, into the cube.
+    # Does nothing if the cube already holds exactly the files in the workspace.
+    cube_path, meta_path = cube_paths(base_dir, prdct)
+    date_keys, file_names = workspace_files(base_dir, prdct)
+
+    if not file_names:
+        print('No rasters found to build the data cube from.')
+        return None
+
+    file_stats = stat_files(base_dir, file_names)
+    meta = read_meta(meta_path)
+    if is_fresh(meta, file_names, file_stats) and os.path.isfile(cube_path):
+        return cube_path
+
+    print(f'Building data cube from {len(file_names)} rasters')
+    ds = gdal.Open(os.path.join(base_dir, file_names[0]))
+    gt = ds.GetGeoTransform()
+    proj = ds.GetProjection()
+    shape = (len(file_names), ds.RasterYSize, ds.RasterXSize)
+    ds = None
+
+    os.makedirs(os.path.dirname(cube_path), exist_ok=True)
+    cube = np.lib.format.open_memmap(cube_path + '.tmp', mode='w+', dtype=np.float32, shape=shape)
+    for i, file_name in enumerate(file_names):
+        ds = gdal.Open(os.path.join(base_dir, file_name))
+        if (ds.RasterYSize, ds.RasterXSize) != shape[1:] or ds.GetGeoTransform() != gt:
+            print(f'{file_name} does not match the grid of the stack, filling with NoData')
+            cube[i] = NODATA
+        else:
+            cube[i] = ds.ReadAsArray()
+        ds = None
+    cube.flush()
+    del cube
+    # Windows can't replace a file that is still mapped
+    close_cube(cube_path)
+    os.replace(cube_path + '.tmp', cube_path)
+
+    meta = {'dates': date_keys, 'files': file_names, 'stats': file_stats, 'gt': list(gt), 'proj': proj,
+            'shape': list(shape), 'nodata': NODATA}
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return cube_path
+
+
+def stat_files(base_dir, file_names):
+    # [mtime_ns, size] of every source file, so a month re-downloaded under the same
+    # name still marks the cube as stale
+    stats = []
+    for file_name in file_names:
+        st = os.stat(os.path.join(base_dir, file_name))
+        stats.append([st.st_mtime_ns, st.st_size])
+    return stats
+
+
+def is_fresh(meta, file_names, file_stats):
+    return meta is not None and meta['files'] == file_names and meta.get('stats') == file_stats
+
+
+def close_cube(cube_path):
+    # drop this process's map of the cube. The file stays mapped until any views
+    # handed out from it (e.g. by read_aoi) are gone as well.
+    entry = CUBE_CACHE.pop(cube_path, None)
+    if entry is not None:
+        del entry
+        gc.collect()
+
+
+def read_meta(meta_path):
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+
+def open_cube(base_dir, prdct='GRD-3'):
+    # return (cube, meta) with the cube memory-mapped read-only, or None if there is no
+    # cube or it is out of date
+    cube_path, meta_path = cube_paths(base_dir, prdct)
+    if cube_path in CUBE_CACHE:
+        return CUBE_CACHE[cube_path]
+
+    meta = read_meta(meta_path)
+    if meta is None or not os.path.isfile(cube_path):
+        return None
+    # a cube that doesn't hold exactly the rasters now in the workspace (one was added,
+    # removed or re-downloaded since it was built) is not used; build_cube refreshes it
+    try:
+        date_keys, file_names = workspace_files(base_dir, prdct)
+        fresh = is_fresh(meta, file_names, stat_files(base_dir, file_names))
+    except OSError:
+        fresh = False
+    if not fresh:
+        print('Data cube is out of date with the workspace, reading the rasters instead.')
+        # remembered like an open cube, so a run reading many frames checks only once;
+        # build_cube clears it
+        CUBE_CACHE[cube_path] = None
+        return None
+
+    cube = np.load(cube_path, mmap_mode='r')
+    CUBE_CACHE[cube_path] = (cube, meta)
+    return cube, meta
+
+
+def dates_in_range(meta, start_date, end_date):
+    # indices and yyyyddd keys of the cube time steps between the two dates (inclusive)
+    start_key = start_date.strftime('%Y%j')
+    end_key = end_date.strftime('%Y%j')
+    steps = [(i, key) for i, key in enumerate(meta['dates']) if start_key <= key <= end_key]
+    return [i for i, key in steps], [key for i, key in steps]
+
+
+def time_index(meta, file_name):
+    # cube time step holding the given source file, None if it isn't in the cube
+    try:
+        return meta['files'].index(os.path.basename(file_name))
+    except ValueError:
+        return None
+
+
+def read_aoi(cube, t, window):
+    # AOI window of one time step as a view into the memory-mapped cube, so nothing is
+    # read until it is used and worker processes mapping the same cube share the page
+    # cache instead of private copies
+    xoff, yoff, xsize, ysize = window
+    return cube[t, yoff:yoff + ysize, xoff:xoff + xsize]
+
+
+def stack_view(cube, time_idx, window):
+    # time x rows x cols AOI stack for the given time steps; a view when the steps are
+    # contiguous (e.g. a date range), otherwise numpy has to gather a copy
+    xoff, yoff, xsize, ysize = window
+    time_idx = np.asarray(time_idx)
+    if time_idx.size > 0 and np.all(np.diff(time_idx) == 1):
+        return cube[time_idx[0]:time_idx[-1] + 1, yoff:yoff + ysize, xoff:xoff + xsize]
+    return cube[time_idx, yoff:yoff + ysize, xoff:xoff + xsize]
+
+
+def mask_nodata(arr, nodata=NODATA):
+    # masked array over arr without copying the data; only the boolean mask of the
+    # (already sliced) values is allocated, at the point the values are used
+    return np.ma.masked_array(arr, mask=(arr == nodata), copy=False)
@@ -3,13 +3,37 @@ Author: Arthur Elmes
 Date: 2021-05-26"""
 
 import requests
+from requests.adapters import HTTPAdapter
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from dateutil.relativedelta import relativedelta
-import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
 
 import sys
 
+VERS = 'v03'
+BASE_URL_GRAC = f'https://podaac-tools.jpl.nasa.gov/drive/files/allData/tellus/L3/grace/land_mass/RL06/{VERS}/JPL/'
+BASE_URL_GRFO = f'https://podaac-tools.jpl.nasa.gov/drive/files/allData/tellus/L3/gracefo/land_mass/RL06/{VERS}/JPL/'
+FILE_FRONT = 'GRD-3_'
+# note the API download credentials
+AUTH = ('arthur.elmes', 'Yrkob5xXqc@CRW5TJn3')
+CHUNK_SIZE = 16 * 1024
+MAX_WORKERS = 8
+MANIFEST_NAME = '.grace_manifest.json'
+# error pages come back tiny and as text/html; real GeoTIFFs are never this small
+MIN_TIF_SIZE = 350
+# answers that mean the month doesn't exist upstream, as opposed to a failed request
+MISSING_STATUS = (404, 410)
+
+# months covered by each mission (inclusive); GRACE-FO is still flying so has no end.
+# Asking GRACE for 2019, or GRACE-FO for 2010, only ever returns an error page.
+MISSION_COVERAGE = {
+    'GRAC': (date(2002, 4, 1), date(2017, 6, 30)),
+    'GRFO': (date(2018, 5, 1), None),
+}
+
 
 def convert_date(in_date):
     #doy = datetime.strptime(in_date, '%Y-%m-%d')
@@ -23,56 +47,299 @@ def convert_doy(doy):
     return date_complete
 
 
-def dl_data(dl_dir, date_start, date_end):
-    vers = 'v03'
-    os.chdir(dl_dir)
-    base_url_grac = f'https://podaac-tools.jpl.nasa.gov/drive/files/allData/tellus/L3/grace/land_mass/RL06/{vers}/JPL/'
-    base_url_grfo = f'https://podaac-tools.jpl.nasa.gov/drive/files/allData/tellus/L3/gracefo/land_mass/RL06/{vers}/JPL/'
-    file_front = 'GRD-3_'
+def make_session(max_workers=MAX_WORKERS, auth=AUTH):
+    # one pooled, keep-alive session shared by all download threads; the pool
+    # is sized to the worker count so no thread has to wait for a connection
+    session = requests.Session()
+    session.auth = auth
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def in_mission(mission, month_start):
+    first, last = MISSION_COVERAGE[mission]
+    if isinstance(month_start, datetime):
+        month_start = month_start.date()
+    return first <= month_start and (last is None or month_start <= last)
+
 
+def make_dl_list(date_start, date_end, base_url_grac=BASE_URL_GRAC, base_url_grfo=BASE_URL_GRFO):
+    # return a list of (url, file name) pairs for every month in the date range,
+    # only asking a mission for the months it actually flew
+    file_end_grac = f'_GRAC_JPLEM_BA01_0600_LND_{VERS}.tif'
+    file_end_grfo = f'_GRFO_JPLEM_BA01_0600_LND_{VERS}.tif'
+
+    dl_list = []
     while date_end > date_start:
         date_start_doy = convert_date(date_start)
         date_next = date_start + relativedelta(months=1) - relativedelta(days=1)
         date_next_doy = convert_date(date_next)
 
         file_date = '{x}-{y}'.format(x=date_start_doy, y=date_next_doy)
-        file_end_grac = f'_GRAC_JPLEM_BA01_0600_LND_{vers}.tif'
-        file_end_gfro = f'_GRFO_JPLEM_BA01_0600_LND_{vers}.tif'
-        dl_url_grac = base_url_grac + file_front + file_date + file_end_grac
-        dl_url_grfo = base_url_grfo + file_front + file_date + file_end_gfro
-        print(f'Downloading {dl_url_grac}')
-        print(f'Downloading {dl_url_grfo}')
+        if in_mission('GRAC', date_start):
+            file_name_grac = FILE_FRONT + file_date + file_end_grac
+            dl_list.append((base_url_grac + file_name_grac, file_name_grac))
+        if in_mission('GRFO', date_start):
+            file_name_grfo = FILE_FRONT + file_date + file_end_grfo
+            dl_list.append((base_url_grfo + file_name_grfo, file_name_grfo))
 
-        # note the API download credentials
-        response_grac = requests.get(dl_url_grac, stream=True, auth=('arthur.elmes', 'Yrkob5xXqc@CRW5TJn3'))
-        response_grfo = requests.get(dl_url_grfo, stream=True, auth=('arthur.elmes', 'Yrkob5xXqc@CRW5TJn3'))
+        date_start = date_start + relativedelta(months=1)
 
-        test_file_name_grac = file_front + file_date + file_end_grac
-        test_file_name_grfo = file_front + file_date + file_end_gfro
+    return dl_list
 
-        if os.path.isfile(test_file_name_grfo):
-            os.remove(test_file_name_grfo)
-        if os.path.isfile(test_file_name_grac):
-            os.remove(test_file_name_grac)
 
-        with open(test_file_name_grac, 'wb') as f:
-            for chunk in response_grac.iter_content(chunk_size=16 * 1024):
-                f.write(chunk)
+def is_valid_response(response):
+    # check the status and headers before touching the body, so that missing
+    # months (gaps within a mission) never end up on disk as error pages
+    if response.status_code not in (200, 206):
+        return False
+    if 'text/html' in response.headers.get('Content-Type', ''):
+        return False
+    content_length = response.headers.get('Content-Length')
+    if response.status_code == 200 and content_length is not None and int(content_length) < MIN_TIF_SIZE:
+        return False
+    return True
 
-        with open(test_file_name_grfo, 'wb') as f:
-            for chunk in response_grfo.iter_content(chunk_size=16 * 1024):
-                f.write(chunk)
 
-        date_start = date_start + relativedelta(months=1)
+def write_response(response, part_path, mode='wb'):
+    with open(part_path, mode) as f:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            f.write(chunk)
+    response.close()
+
+
+def dl_file(session, dl_url, file_path):
+    print(f'Downloading {dl_url}')
+    response = session.get(dl_url, stream=True)
+    if not is_valid_response(response):
+        response.close()
+        print(f'Skipping {dl_url}: HTTP {response.status_code}')
+        return None
+
+    # stream into a .part file and only rename once complete
+    write_response(response, file_path + '.part')
+    os.replace(file_path + '.part', file_path)
+
+    return file_path
+
+
+def file_md5(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def read_manifest(dl_dir):
+    # manifest maps file name -> size, etag, last_modified and md5 of the complete file
+    manifest_path = os.path.join(dl_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        print('Download manifest is corrupt, rebuilding it.')
+        return {}
+
+
+def write_manifest(dl_dir, manifest):
+    # write to a temp file first so an interrupted run never leaves half a manifest
+    manifest_path = os.path.join(dl_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
 
-    # TODO this needs a real solution!
-    cleanup(dl_dir)
+def is_complete(file_path, entry):
+    # a file is complete if it matches the size and checksum recorded when it finished
+    if entry is None or not os.path.isfile(file_path):
+        return False
+    if os.path.getsize(file_path) != entry.get('size'):
+        return False
+    return file_md5(file_path) == entry.get('md5')
 
 
-def cleanup(dir):
-    for file in glob.glob(os.path.join(dir, "*.tif")):
-        if os.path.getsize(file) < 350:
-            os.remove(file)
+def read_part_meta(part_path):
+    # etag and last_modified of the upstream file a .part file was started from, or {}
+    try:
+        with open(part_path + '.json', 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_part_meta(part_path, response):
+    # saved when a download starts, so a later resume can ask for the rest of that same
+    # file with If-Range (manifest entries only exist for complete files)
+    with open(part_path + '.json', 'w') as f:
+        json.dump({'etag': response.headers.get('ETag'),
+                   'last_modified': response.headers.get('Last-Modified')}, f)
+
+
+def remove_part(part_path):
+    for path in (part_path, part_path + '.json'):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def expected_size(response, offset):
+    # full size of the upstream file from Content-Range (206) or Content-Length (200),
+    # None if the server didn't say. A 206 for a different range than asked for is -1.
+    if response.status_code == 206:
+        content_range = response.headers.get('Content-Range', '')
+        try:
+            unit, spec = content_range.split(' ', 1)
+            first, total = spec.split('/', 1)
+            if int(first.split('-', 1)[0]) != offset:
+                return -1
+            return int(total) if total != '*' else None
+        except ValueError:
+            return -1
+    # a compressed body is decoded on the fly, so its length says nothing about the file
+    content_length = response.headers.get('Content-Length')
+    if content_length is None or response.headers.get('Content-Encoding'):
+        return None
+    return int(content_length)
+
+
+def sync_file(session, dl_url, file_path, entry=None, revalidate=False):
+    # incremental counterpart of dl_file: skip complete files, resume partial ones
+    # with a Range request, and return the new manifest entry (None if unchanged)
+    part_path = file_path + '.part'
+    headers = {}
+    # gaps within a mission are remembered, so they are only re-checked on revalidation
+    if entry is not None and entry.get('missing') and not revalidate:
+        return None
+    offset = 0
+    if is_complete(file_path, entry):
+        if not revalidate:
+            return None
+        # only ask upstream whether the file changed; 304 means nothing to do
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    elif os.path.isfile(part_path) and os.path.getsize(part_path) > 0:
+        # If-Range makes the server send the whole file if it changed since the partial
+        # write. A partial file without a validator can't be checked, so it is refetched.
+        part_meta = read_part_meta(part_path)
+        validator = part_meta.get('etag') or part_meta.get('last_modified')
+        if validator:
+            offset = os.path.getsize(part_path)
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+
+    print(f'Syncing {dl_url}')
+    response = session.get(dl_url, stream=True, headers=headers)
+    if response.status_code == 304:
+        response.close()
+        return None
+    if not is_valid_response(response):
+        response.close()
+        print(f'Skipping {dl_url}: HTTP {response.status_code}')
+        # only a month the server says doesn't exist is cached as missing; anything else
+        # (auth, rate limits, server errors) is retried next run
+        if response.status_code in MISSING_STATUS:
+            return {'missing': True}
+        # the partial file no longer fits the upstream file, so start over next run
+        if response.status_code == 416:
+            remove_part(part_path)
+        return None
+
+    # 206 appends to the partial file, anything else starts from scratch
+    size = expected_size(response, offset)
+    if size == -1:
+        response.close()
+        print(f'Skipping {dl_url}: unexpected Content-Range, restarting next run')
+        remove_part(part_path)
+        return None
+    if response.status_code == 206:
+        mode = 'ab'
+    else:
+        mode = 'wb'
+        write_part_meta(part_path, response)
+    write_response(response, part_path, mode)
+    if size is not None and os.path.getsize(part_path) != size:
+        # a short read is resumed next run; a file grown past the total can't be trusted
+        print(f'Incomplete download of {dl_url}: {os.path.getsize(part_path)} of {size} bytes')
+        if os.path.getsize(part_path) > size:
+            remove_part(part_path)
+        return None
+    os.replace(part_path, file_path)
+    remove_part(part_path)
+
+    return {'size': os.path.getsize(file_path),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'md5': file_md5(file_path)}
+
+
+def iter_downloads(dl_dir, date_start, date_end, max_workers=MAX_WORKERS,
+                   base_url_grac=BASE_URL_GRAC, base_url_grfo=BASE_URL_GRFO,
+                   sync=False, revalidate=False):
+    # download the date range and yield (done, total, file_path, is_new) as each file
+    # finishes, so later stages can start on it straight away. file_path is None when there
+    # is no file for that month; in sync mode files that were already complete are yielded
+    # too, with is_new False, so later stages can skip work they already did for them.
+    dl_list = make_dl_list(date_start, date_end, base_url_grac, base_url_grfo)
+
+    # downloads are latency bound, so run them on a thread pool sharing one session
+    session = make_session(max_workers)
+    if sync:
+        manifest = read_manifest(dl_dir)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if sync:
+            futures = {executor.submit(sync_file, session, dl_url, os.path.join(dl_dir, file_name),
+                                       manifest.get(file_name), revalidate): file_name
+                       for dl_url, file_name in dl_list}
+        else:
+            futures = {executor.submit(dl_file, session, dl_url, os.path.join(dl_dir, file_name)): file_name
+                       for dl_url, file_name in dl_list}
+        try:
+            for i, future in enumerate(as_completed(futures)):
+                file_name = futures[future]
+                try:
+                    result = future.result()
+                except requests.RequestException as e:
+                    print(f'Download failed: {e}')
+                    result = None
+                # manifest is only touched from this thread, so no locking is needed
+                if sync and result is not None:
+                    manifest[file_name] = result
+                # dl_file returns the path it wrote, sync_file the entry of a file it wrote
+                is_new = result is not None and not (sync and result.get('missing'))
+
+                file_path = os.path.join(dl_dir, file_name)
+                yield i + 1, len(futures), file_path if os.path.isfile(file_path) else None, is_new
+        except BaseException:
+            # don't start any more downloads, but keep what already finished
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            session.close()
+            if sync:
+                write_manifest(dl_dir, manifest)
+
+
+def dl_data(dl_dir, date_start, date_end, max_workers=MAX_WORKERS,
+            base_url_grac=BASE_URL_GRAC, base_url_grfo=BASE_URL_GRFO,
+            sync=False, revalidate=False, progress=None):
+    # progress, if given, is called as progress(done, total) after every file; an
+    # exception raised from it (e.g. to cancel) stops the remaining downloads
+    downloads = iter_downloads(dl_dir, date_start, date_end, max_workers,
+                               base_url_grac, base_url_grfo, sync, revalidate)
+    try:
+        for done, total, file_path, is_new in downloads:
+            if progress is not None:
+                progress(done, total)
+    finally:
+        # stops the pool and saves the manifest straight away if progress raised
+        downloads.close()
 
 
 if __name__ == '__main__':
@@ -83,7 +350,3 @@ if __name__ == '__main__':
     date_1 = datetime.strptime('2020-12-01', '%Y-%m-%d')
 
     dl_data(workspace, date_0, date_1)
-
-    # TODO this needs a real solution!
-    cleanup(workspace)
-
@@ -0,0 +1,97 @@
+"""This module keeps the pixel values extracted for a set of sample sites on disk, so that
+re-running a time series only reads the rasters that are new or have changed since the
+last run. Values are stored per raster and site set in a small SQLite database, keyed
+by the raster path plus its mtime and size, and a hash of the site coordinates. The
+least recently used entries are evicted once the cache grows past MAX_CACHE_BYTES."""
+
+import os
+import time
+import sqlite3
+import hashlib
+import numpy as np
+
+# kept in its own folder: sqlite journal files come and go on every write, which would
+# otherwise change the workspace mtime and invalidate the raster index
+CACHE_DIR = '.cache'
+CACHE_NAME = 'extract_cache.sqlite'
+MAX_CACHE_BYTES = 256 * 1024 ** 2
+# seconds to wait for another run holding the write lock
+BUSY_TIMEOUT = 30
+
+
+def cache_path(base_dir):
+    return os.path.join(base_dir, CACHE_DIR, CACHE_NAME)
+
+
+def open_cache(base_dir):
+    # the workspace cache, created on first use, as a dict holding the connection and
+    # the entries read so far. Lookups never write: their last_used times are saved in
+    # one go by close_cache, so a run only holds the write lock for its own inserts and
+    # other runs can share the cache (waiting up to BUSY_TIMEOUT seconds for the lock).
+    path = cache_path(base_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute('CREATE TABLE IF NOT EXISTS site_values ('
+                 'path TEXT, sites TEXT, mtime_ns INTEGER, size INTEGER, '
+                 'data BLOB, nbytes INTEGER, last_used REAL, '
+                 'PRIMARY KEY (path, sites))')
+    conn.commit()
+    return {'conn': conn, 'touched': set()}
+
+
+def sites_hash(lats, lons):
+    # identifies a site set by its coordinates (and their order), not by the csv name
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(lons, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def get_values(cache, file_path, site_key):
+    # cached values of file_path at the sites, None if missing or the file has changed
+    # (a changed file's entry is overwritten by the next put_values)
+    st = os.stat(file_path)
+    path = os.path.abspath(file_path)
+    row = cache['conn'].execute('SELECT mtime_ns, size, data FROM site_values WHERE path = ? AND sites = ?',
+                                (path, site_key)).fetchone()
+    if row is None or (row[0], row[1]) != (st.st_mtime_ns, st.st_size):
+        return None
+    cache['touched'].add((path, site_key))
+    return np.frombuffer(row[2], dtype=np.float64).copy()
+
+
+def put_values(cache, file_path, site_key, values):
+    # stored and committed straight away, keeping the write lock only briefly
+    st = os.stat(file_path)
+    data = np.ascontiguousarray(values, dtype=np.float64).tobytes()
+    with cache['conn']:
+        cache['conn'].execute('INSERT OR REPLACE INTO site_values VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (os.path.abspath(file_path), site_key, st.st_mtime_ns, st.st_size,
+                               sqlite3.Binary(data), len(data), time.time()))
+
+
+def evict(conn, max_bytes=MAX_CACHE_BYTES):
+    # drop the least recently used entries until the cache fits in max_bytes
+    total = 0
+    stale = []
+    for path, site_key, nbytes in conn.execute('SELECT path, sites, nbytes FROM site_values '
+                                               'ORDER BY last_used DESC'):
+        total += nbytes
+        if total > max_bytes:
+            stale.append((path, site_key))
+    if stale:
+        conn.executemany('DELETE FROM site_values WHERE path = ? AND sites = ?', stale)
+    return len(stale)
+
+
+def close_cache(cache, max_bytes=MAX_CACHE_BYTES):
+    # save the last_used times of the entries read, evict and close, in one short
+    # write transaction; call once at the end of a run
+    conn = cache['conn']
+    try:
+        with conn:
+            conn.executemany('UPDATE site_values SET last_used = ? WHERE path = ? AND sites = ?',
+                             [(time.time(), path, site_key) for path, site_key in cache['touched']])
+            evict(conn, max_bytes)
+    finally:
+        conn.close()
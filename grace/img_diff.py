@@ -6,21 +6,21 @@ Author: Arthur Elmes
 
 import os
 # some odd error with the basemap data
-try:
-    print(os.environ['PROJ_LIB'])
-except:
+if 'PROJ_LIB' not in os.environ:
     os.environ["PROJ_LIB"] = r"C:\Users\arthu\Anaconda3\envs\e84_win\Library\share\proj"
-print(os.environ['PROJ_LIB'])
 
-from osgeo import osr
-from mpl_toolkits.basemap import Basemap
 import numpy as np
 import matplotlib.pyplot as plt
 import glob
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 # this pckg
 from grace import viz_grace
+from grace import plot_worker
+from grace import data_cube
+from grace import workspace_index
 
 
 def get_file_from_date(base_dir, in_date):
@@ -29,65 +29,35 @@ def get_file_from_date(base_dir, in_date):
     return file_name
 
 
-def img_diff(img_file_0, img_file_1, o_dir, contrast_stretch, ul_coord, lr_coord):
-    coords = '_'.join([str(ul_coord[0]), str(ul_coord[1]), str(lr_coord[0]), str(lr_coord[1])])
+def img_diff(img_file_0, img_file_1, o_dir, contrast_stretch, ul_coord, lr_coord, use_cube=False, stretch=None):
+    coords = viz_grace.aoi_coords(ul_coord, lr_coord)
     o_dir = os.path.join(o_dir, 'map_exports', coords)
 
     if not os.path.exists(o_dir):
         os.makedirs(o_dir, exist_ok=True)
 
     # a lot of this should be condensed with viz_grace
-    # use gdal to read in data as np array
-    data_0, gt_0, proj_0 = viz_grace.img_to_arr(img_file_0)
-    data_1, gt_1, proj_1 = viz_grace.img_to_arr(img_file_1)
+    # use gdal to read the AOI window in as np array
+    data_0, gt_0, proj_0 = viz_grace.read_aoi(img_file_0, ul_coord, lr_coord, use_cube)
+    data_1, gt_1, proj_1 = viz_grace.read_aoi(img_file_1, ul_coord, lr_coord, use_cube)
 
     # mask out the NoData
-    data_0 = np.ma.masked_array(data_0, data_0 == -99999.0)
-    data_1 = np.ma.masked_array(data_1, data_1 == -99999.0)
-
-    # parse geotransform details
-    # can be the same, because both files should have identical SRS and dims
-    xres = gt_0[1]
-    yres = gt_0[5]
-    xmin = ul_coord[1]
-    xmax = lr_coord[1]
-    ymax = ul_coord[0]
-    ymin = lr_coord[0]
-
-    # TODO figure out weird quirk in central longitude
-    m = Basemap(projection='laea',
-                llcrnrlat=ymin,
-                urcrnrlat=ymax,
-                llcrnrlon=xmin,
-                urcrnrlon=xmax,
-                lon_0=((xmax+xmin)/2),
-                lat_0=ymax+10,
-                lat_1=((ymax+ymin)/2),
-                lat_2=ymin-10,
-                resolution='c')
-
-    # make grid of xy coords for plotting
-    xy_source = np.mgrid[ymax:ymin - 1:yres, xmin:xmax + 1:xres]
-    inproj = osr.SpatialReference()
-    inproj.ImportFromWkt(proj_0)
-    outproj = osr.SpatialReference()
-    outproj.ImportFromProj4(m.proj4string)
-    xx, yy = viz_grace.convert_xy(xy_source, inproj, outproj)
-
-    # These to be implemented with any data with units that
-    # aren't degrees, unlike the GRACE gridded data
-    # col0, col1 = int((90 - ymax + xres * 0.5) / xres), \
-    #              int((90 - ymin + xres * 0.5) / yres)
-    # row0, row1 = int((180 + xmin) / gt[5]), \
-    #              int((180 + xmax) / gt[5])
-
-    # slice data based on user extent
-    data_0 = data_0[90 - ymax:90 - ymin, xmin + 180:xmax + 180]
-    data_1 = data_1[90 - ymax:90 - ymin, xmin + 180:xmax + 180]
+    # both files should have identical SRS and dims, so the first geotransform serves for both
+    data_0 = data_cube.mask_nodata(data_0)
+    data_1 = data_cube.mask_nodata(data_1)
 
     # take image difference to show change
     data_diff = data_1 - data_0
 
+    plot_diff(data_diff, gt_0, proj_0, img_file_0, img_file_1, o_dir, ul_coord, lr_coord, stretch)
+
+
+def plot_diff(data_diff, gt, proj, img_file_0, img_file_1, o_dir, ul_coord, lr_coord, stretch=None):
+    # render one difference map over the AOI window described by gt/proj into o_dir
+    # projection and plotting grid are shared with viz_grace for the same AOI
+    m, xx, yy = viz_grace.get_map_grid(ul_coord, lr_coord, proj, gt, data_diff.shape,
+                                       os.path.join(os.path.dirname(o_dir), 'grid_cache'))
+
     # plotting stuff
     fig = plt.figure(figsize=(12, 6))
     ax = fig.add_subplot(111)
@@ -96,9 +66,8 @@ def img_diff(img_file_0, img_file_1, o_dir, contrast_stretch, ul_coord, lr_coord
             ' and ' + os.path.splitext(os.path.basename(img_file_1))[0][6:21]
     ax.set_title(title, loc='center', pad=22, color='white')
 
-    # TODO these need to be dynamic
-    stretch_min = -0.25
-    stretch_max = 0.25
+    # fixed stretch unless one was computed from the whole AOI stack
+    stretch_min, stretch_max = stretch if stretch is not None else viz_grace.DEFAULT_STRETCH
 
     im = m.pcolormesh(xx,
                       yy,
@@ -135,7 +104,9 @@ def img_diff(img_file_0, img_file_1, o_dir, contrast_stretch, ul_coord, lr_coord
     cb.set_label('GRACE Groundwater Anomaly', color='white')
     cb.ax.xaxis.set_tick_params(color='white')
     cb.ax.yaxis.set_tick_params(color='white')
-    cb.ax.set_xticklabels(np.round(np.arange(stretch_min, stretch_max+0.1, 0.1), 2),
+    ticks = np.linspace(stretch_min, stretch_max, 6)
+    cb.ax.set_xticks(ticks)
+    cb.ax.set_xticklabels(np.round(ticks, 2),
                           color='white')
 
     f_name = os.path.join(o_dir, "_".join([os.path.basename(img_file_0[:-4]),
@@ -145,6 +116,7 @@ def img_diff(img_file_0, img_file_1, o_dir, contrast_stretch, ul_coord, lr_coord
                                            str(lr_coord[0]), 'Deg_',
                                            str(lr_coord[1]), 'Deg']))
     fig.savefig(f_name)
+    plt.close(fig)
     # fig.savefig('{a}{b}_{c}_{d}_{e}.png'.format(a=o_dir,
     #                                                 b=os.path.basename(img_file_0[:-4]),
     #                                                 c=os.path.basename(img_file_1[:-4]),
@@ -152,10 +124,129 @@ def img_diff(img_file_0, img_file_1, o_dir, contrast_stretch, ul_coord, lr_coord
     #                                                 e=str(lr_coord[0]) + 'Deg_' + str(lr_coord[1]) + 'Deg'))
 
 
-def run_img_diff(start_date, end_date, ul_coord, lr_coord, workspace):
+def diff_stretch(workspace, ul_coord, lr_coord, use_cube=False):
+    # symmetric stretch from the same cached stack statistics the AOI maps use
+    file_list = sorted(glob.glob(os.path.join(workspace, "*JPLEM_BA01_0600_LND_*.tif")))
+    return viz_grace.aoi_stretch(workspace, ul_coord, lr_coord, file_list, use_cube, symmetric=True)
+
+
+def run_img_diff(start_date, end_date, ul_coord, lr_coord, workspace, use_cube=False, dynamic_stretch=False,
+                 progress=None):
+    # progress, if given, is called as progress(done, total) before and after the map
+    if progress is not None:
+        progress(0, 1)
     img_file_0 = get_file_from_date(workspace, start_date)
     img_file_1 = get_file_from_date(workspace, end_date)
-    img_diff(img_file_0, img_file_1, workspace, True, ul_coord, lr_coord)
+    stretch = diff_stretch(workspace, ul_coord, lr_coord, use_cube) if dynamic_stretch else None
+    img_diff(img_file_0, img_file_1, workspace, True, ul_coord, lr_coord, use_cube, stretch)
+    if progress is not None:
+        progress(1, 1)
+
+
+def make_date_pairs(date_keys, rule='year'):
+    # (earlier, later) yyyyddd pairs from the available dates: 'month' pairs every month
+    # with the month before, 'year' with the same month of the year before
+    months = {}
+    for key in date_keys:
+        date = datetime.strptime(key, '%Y%j')
+        months[(date.year, date.month)] = key
+
+    pairs = []
+    for (year, month), key in sorted(months.items()):
+        if rule == 'month':
+            prev = (year - 1, 12) if month == 1 else (year, month - 1)
+        elif rule == 'year':
+            prev = (year - 1, month)
+        else:
+            raise ValueError(f'Unknown date pair rule {rule}, use month or year')
+        if prev in months:
+            pairs.append((months[prev], key))
+    return pairs
+
+
+def run_img_diff_batch(workspace, ul_coord, lr_coord, pairs=None, rule='year', max_workers=None, use_cube=False,
+                       dynamic_stretch=False, progress=None):
+    # difference maps for many (start, end) yyyyddd pairs, or for every pair the stride
+    # rule gives over the whole workspace. Each raster is read once, all differences are
+    # taken in one vectorized step on the stacked AOI windows, and the maps are rendered
+    # on a process pool (max_workers=1 renders in this process). progress, if given, is
+    # called as progress(done, total) after every map.
+    coords = viz_grace.aoi_coords(ul_coord, lr_coord)
+    o_dir = os.path.join(workspace, 'map_exports', coords)
+    if not os.path.exists(o_dir):
+        os.makedirs(o_dir, exist_ok=True)
+
+    index = workspace_index.build_index(workspace)
+    if pairs is None:
+        date_keys = sorted(key for key in index
+                           if workspace_index.lookup(index, workspace, 'GRD-3', key[:4], key[4:]))
+        pairs = make_date_pairs(date_keys, rule)
+
+    # find the file for every date once, dropping pairs with a missing date
+    files = {}
+    for key in set(key for pair in pairs for key in pair):
+        file_list = workspace_index.lookup(index, workspace, 'GRD-3', key[:4], key[4:])
+        if file_list:
+            files[key] = file_list[0]
+        else:
+            print(f'File not found for {key} -- make sure you have a file for this date!')
+    pairs = [pair for pair in pairs if pair[0] in files and pair[1] in files]
+    if not pairs:
+        print('No date pairs to difference.')
+        return
+
+    # a dates x rows x cols stack of the AOI windows: a view into the data cube when it
+    # holds every date, otherwise each window is read once
+    keys = sorted(set(key for pair in pairs for key in pair))
+    stack = None
+    cube = data_cube.open_cube(workspace) if use_cube else None
+    if cube is not None:
+        cube, meta = cube
+        time_idx = [data_cube.time_index(meta, files[key]) for key in keys]
+        if None not in time_idx:
+            window = viz_grace.aoi_window(meta['gt'], ul_coord, lr_coord, *meta['shape'][1:])
+            stack = data_cube.stack_view(cube, time_idx, window)
+            gt_0, proj_0 = viz_grace.window_geotransform(meta['gt'], window), meta['proj']
+    if stack is None:
+        for i, key in enumerate(keys):
+            data, gt, proj = viz_grace.read_aoi(files[key], ul_coord, lr_coord)
+            if stack is None:
+                stack = np.empty((len(keys),) + data.shape, dtype=np.float32)
+                gt_0, proj_0 = gt, proj
+            stack[i] = data
+
+    # all the differences at once, NoData in either date as NaN
+    pos = {key: i for i, key in enumerate(keys)}
+    stack_0 = stack[[pos[pair[0]] for pair in pairs]]
+    stack_1 = stack[[pos[pair[1]] for pair in pairs]]
+    diffs = np.where((stack_0 == data_cube.NODATA) | (stack_1 == data_cube.NODATA), np.nan, stack_1 - stack_0)
+
+    stretch = diff_stretch(workspace, ul_coord, lr_coord, use_cube) if dynamic_stretch else None
+    jobs = [(np.ma.masked_invalid(diff), gt_0, proj_0, files[pair[0]], files[pair[1]], o_dir, ul_coord, lr_coord,
+             stretch)
+            for diff, pair in zip(diffs, pairs)]
+    print(f'Rendering {len(jobs)} difference maps')
+    if max_workers == 1:
+        for i, job in enumerate(jobs):
+            plot_diff(*job)
+            if progress is not None:
+                progress(i + 1, len(jobs))
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=plot_worker.init_worker) as executor:
+        futures = {executor.submit(plot_diff, *job): job[3:5] for job in jobs}
+        try:
+            for i, future in enumerate(as_completed(futures)):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'Difference map failed for {futures[future]}: {e}')
+                if progress is not None:
+                    progress(i + 1, len(futures))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
 
 if __name__ == '__main__':
@@ -0,0 +1,89 @@
+"""Background job scheduler for the GUI, so that downloads, renders and analyses run in
+worker threads while the window stays responsive. Jobs queue up behind a fixed number of
+workers; each job reports its state and progress back to the window as '-JOB-' events
+(via window.write_event_value), and can be cancelled while queued or while running.
+pyplot keeps global state (current figure, rc params), so jobs that plot in this process
+go to a separate single worker and never run at the same time as each other."""
+
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_EVENT = '-JOB-'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobScheduler:
+    # long running functions take a progress(done, total) callback; cancelling a running
+    # job makes its next progress call raise JobCancelled, which unwinds the job
+
+    def __init__(self, window, max_workers=2):
+        self.window = window
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.plot_executor = ThreadPoolExecutor(max_workers=1)
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def post(self, job_id, state, info=''):
+        with self.lock:
+            job = self.jobs[job_id]
+            job['state'] = state
+            job['info'] = info
+        self.window.write_event_value(JOB_EVENT, (job_id, state, info))
+
+    def submit(self, name, fn, *args, plots=False, **kwargs):
+        # queue fn(*args, progress=..., **kwargs) and return its job id. Set plots for
+        # jobs that use pyplot, so they run one at a time.
+        job_id = next(self.ids)
+        cancel_event = threading.Event()
+        with self.lock:
+            self.jobs[job_id] = {'name': name, 'state': 'queued', 'info': '', 'cancel': cancel_event}
+
+        def progress(done, total):
+            if cancel_event.is_set():
+                raise JobCancelled()
+            self.post(job_id, 'running', f'{done}/{total}')
+
+        def run():
+            if cancel_event.is_set():
+                self.post(job_id, 'cancelled')
+                return
+            self.post(job_id, 'running')
+            try:
+                fn(*args, progress=progress, **kwargs)
+            except JobCancelled:
+                self.post(job_id, 'cancelled')
+            except Exception as e:
+                self.post(job_id, 'failed', str(e))
+            else:
+                self.post(job_id, 'done')
+
+        executor = self.plot_executor if plots else self.executor
+        self.jobs[job_id]['future'] = executor.submit(run)
+        self.window.write_event_value(JOB_EVENT, (job_id, 'queued', ''))
+        return job_id
+
+    def cancel(self, job_id):
+        # queued jobs never start; running jobs stop at their next progress report
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None or job['state'] in ('done', 'failed', 'cancelled'):
+            return
+        job['cancel'].set()
+        if job['future'].cancel():
+            self.post(job_id, 'cancelled')
+
+    def status_lines(self):
+        with self.lock:
+            return [f"{job_id}: {job['name']} - {job['state']} {job['info']}".rstrip()
+                    for job_id, job in self.jobs.items()]
+
+    def shutdown(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        self.executor.shutdown(wait=False)
+        self.plot_executor.shutdown(wait=False)
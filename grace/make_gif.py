@@ -1,26 +1,86 @@
 """Compile all PNGs in the given directory into an animated gif for visualization.
+Frames are streamed to the encoder one at a time, so memory does not grow with the
+length of the stack; an MP4/WebM can be written instead of a gif for long series.
 Author: Arthur Elmes
 2021-05-28"""
 
 import imageio
+import numpy as np
+from PIL import Image
 import os
 
 
-def make_gif(png_dir, gif_dir):
+def make_writer(out_path, duration=0.75):
+    # gif takes a per-frame duration, the video formats (which need the imageio-ffmpeg
+    # plugin) take a frame rate instead
+    if out_path.lower().endswith('.gif'):
+        return imageio.get_writer(out_path, mode='I', format='GIF', duration=duration)
+    return imageio.get_writer(out_path, mode='I', fps=1 / duration, macro_block_size=1)
+
+
+def prepare_frame(frame, scale=1.0, palette_img=None):
+    # drop alpha, optionally downscale, and map onto a shared palette so that colours
+    # stay stable across the animation instead of being re-quantized every frame
+    frame = np.asarray(frame)[:, :, :3]
+    if scale == 1.0 and palette_img is None:
+        return frame
+
+    img = Image.fromarray(frame)
+    if scale != 1.0:
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                         Image.LANCZOS)
+    if palette_img is not None:
+        img = img.quantize(palette=palette_img).convert('RGB')
+    return np.asarray(img)
+
+
+def write_frames(frames, out_path, duration=0.75, scale=1.0, reuse_palette=False):
+    # stream an iterable of RGB(A) arrays into out_path, one frame in memory at a time.
+    # frames can be a generator, e.g. straight from the renderer, so no PNGs are needed.
+    palette_img = None
+    n_frames = 0
+    with make_writer(out_path, duration) as writer:
+        for frame in frames:
+            if reuse_palette and palette_img is None:
+                # the palette comes from the first frame and is reused for the rest
+                first = Image.fromarray(prepare_frame(frame, scale))
+                palette_img = first.quantize(colors=256)
+            writer.append_data(prepare_frame(frame, scale, palette_img))
+            n_frames += 1
+    return n_frames
+
+
+def read_pngs(png_dir, gif_list):
+    # decode the PNGs lazily, one per frame written
+    for file_name in gif_list:
+        yield imageio.imread(os.path.join(png_dir, file_name))
+
+
+def animation_path(gif_dir, name, out_format='gif'):
+    # <gif_dir>/<name>.<format>, e.g. the AOI coords; made the same way whether the frames
+    # come from PNGs or straight from the renderer
     if not os.path.isdir(gif_dir):
         os.mkdir(gif_dir)
+    return os.path.join(gif_dir, name + '.' + out_format)
+
 
+def make_gif(png_dir, gif_dir, out_format='gif', scale=1.0, reuse_palette=False, duration=0.75):
+    # the animation is named after png_dir, which holds one AOI's maps
     gif_list = [file for file in os.listdir(png_dir) if file.endswith('.png')]
     gif_list.sort()
-    images = []
-    for file_name in gif_list:
-        images.append(imageio.imread(os.path.join(png_dir, file_name)))
+    if not gif_list:
+        print('failed to make gif! Check input maps and directories.')
+        return
+
+    out_path = animation_path(gif_dir, os.path.basename(os.path.normpath(png_dir)), out_format)
     try:
-        imageio.mimsave(gif_dir + file_name + '.gif', images, 'GIF', duration=0.75)
-    except:
+        write_frames(read_pngs(png_dir, gif_list), out_path, duration, scale, reuse_palette)
+    except Exception:
         print('failed to make gif! Check input maps and directories.')
+        return
 
-    print(f'Animated gif created: {os.path.join(gif_dir, file_name)}6.gif')
+    print(f'Animation created: {out_path}')
+    return out_path
 
 
 if __name__ == '__main__':
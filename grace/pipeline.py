@@ -0,0 +1,178 @@
+"""Streaming pipeline for a full refresh: download -> validate/index -> sample + render.
+Each monthly tile moves on to the next stage as soon as it arrives instead of waiting for
+the whole date range, so a refresh takes roughly as long as its slowest stage rather than
+the sum of all of them. Stages run in their own threads connected by bounded queues, so a
+fast stage can never run far ahead of a slow one.
+In sync mode months that were already complete on disk are still sampled (mostly from the
+extraction cache), but are not validated again and are only rendered for AOI boxes that
+don't have a map of them yet, so a refresh only does real work for the new tiles."""
+
+import os
+import queue
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from osgeo import gdal
+
+# modules in this package
+from grace import download_grace
+from grace import workspace_index
+from grace import time_series_aoi
+from grace import viz_grace
+from grace import plot_worker
+from grace import make_gif
+from grace import extract_cache
+
+# marks the end of the stream on a queue
+DONE = None
+
+
+def validate_tile(file_path):
+    # yyyyddd key of a downloaded tile, or None if it isn't a readable single band raster
+    keys = workspace_index.parse_file_dates(os.path.basename(file_path))
+    if not keys:
+        return None
+    ds = gdal.Open(file_path)
+    if ds is None or ds.RasterCount < 1 or ds.RasterXSize == 0 or ds.RasterYSize == 0:
+        return None
+    ds = None
+    return keys[0]
+
+
+def run_pipeline(dl_dir, date_start, date_end, aoi_boxes=(), csv_names=(), prdct='GRD-3',
+                 sync=True, queue_size=8, max_workers=None, progress=None):
+    # refresh the workspace and, as tiles arrive, sample them for every AOI sample csv in
+    # csv_names and render a map of every (ul, lr) box in aoi_boxes. The time series csvs,
+    # graphs and the gifs are written once the stream ends, since they need every date.
+    q_valid = queue.Queue(maxsize=queue_size)
+    q_sample = queue.Queue(maxsize=queue_size)
+    q_render = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    # sites of all AOIs stacked together, so each tile is opened once for all of them
+    aoi_ids = []
+    aoi_sites = []
+    for csv_name in csv_names:
+        site_ids, lats, lons = time_series_aoi.read_sites(os.path.join(dl_dir, csv_name))
+        aoi_ids.append(site_ids)
+        aoi_sites.append((lats, lons))
+    samples = {}
+
+    def stage(fn, q_in, q_outs):
+        # run fn on every item of q_in, passing results to q_outs, until the stream ends.
+        # After an error the stage keeps draining q_in so the stages upstream never block.
+        def run():
+            while True:
+                item = q_in.get()
+                if item is DONE:
+                    break
+                if errors:
+                    continue
+                try:
+                    result = fn(item)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if result is not None:
+                    for q_out in q_outs:
+                        q_out.put(result)
+            for q_out in q_outs:
+                q_out.put(DONE)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def validate(tile):
+        # tiles that were already complete on disk were validated when they arrived
+        file_path, is_new = tile
+        if not is_new:
+            keys = workspace_index.parse_file_dates(os.path.basename(file_path))
+            return (keys[0], file_path, is_new) if keys else None
+        date_key = validate_tile(file_path)
+        if date_key is None:
+            print(f'Skipping invalid tile {file_path}')
+            return None
+        return date_key, file_path, is_new
+
+    # only the sample stage touches the extraction cache, with the same per AOI entries
+    # as time_series_aoi.extract_aois
+    cache = None
+    if aoi_sites:
+        all_lats, all_lons, aoi_slices = time_series_aoi.stack_sites(aoi_sites)
+        site_keys = [extract_cache.sites_hash(lats, lons) for lats, lons in aoi_sites]
+        cache = extract_cache.open_cache(dl_dir)
+
+    def sample(tile):
+        # every tile is sampled, as the time series need every date; tiles that were
+        # already complete are normally served from the extraction cache
+        date_key, file_path, is_new = tile
+        if cache is None:
+            return
+        samples[date_key], was_read = time_series_aoi.extract_aoi_values(file_path, all_lats, all_lons,
+                                                                         aoi_slices, site_keys, cache)
+
+    # renders run on a process pool; only a bounded number are in flight at once
+    executor = ProcessPoolExecutor(max_workers=max_workers, initializer=plot_worker.init_worker)
+    renders = queue.Queue(maxsize=queue_size)
+
+    def render(tile):
+        date_key, file_path, is_new = tile
+        for ul, lr in aoi_boxes:
+            coords = viz_grace.aoi_coords(ul, lr)
+            out_dir = os.path.join(dl_dir, 'map_exports', coords)
+            cache_dir = os.path.join(dl_dir, 'map_exports', 'grid_cache')
+            # a tile that was already complete only needs a map if this box has none yet
+            if not is_new and os.path.isfile(viz_grace.png_path(file_path, out_dir, ul, lr)):
+                continue
+            if renders.full():
+                renders.get().result()
+            renders.put(executor.submit(viz_grace.make_plot, file_path, out_dir, True, ul, lr,
+                                        cache_dir, True))
+
+    threads = [stage(validate, q_valid, [q_sample, q_render]),
+               stage(sample, q_sample, []),
+               stage(render, q_render, [])]
+
+    # the download stage feeds the queue from this thread
+    downloads = download_grace.iter_downloads(dl_dir, date_start, date_end, sync=sync)
+    try:
+        for done, total, file_path, is_new in downloads:
+            if errors:
+                break
+            if file_path is not None:
+                q_valid.put((file_path, is_new))
+            if progress is not None:
+                progress(done, total)
+    finally:
+        downloads.close()
+        q_valid.put(DONE)
+        for thread in threads:
+            thread.join()
+        while not renders.empty():
+            try:
+                renders.get().result()
+            except Exception as e:
+                errors.append(e)
+        executor.shutdown()
+        if cache is not None:
+            extract_cache.close_cache(cache)
+
+    if errors:
+        raise errors[0]
+
+    # the stream has ended: per AOI outputs that need the full series
+    date_keys = sorted(samples)
+    if date_keys:
+        # for the time series graphs, must have full years of data
+        ts_start = datetime(date_start.year, 1, 1)
+        ts_end = datetime(date_end.year, 12, 31)
+        all_values = np.column_stack([samples[key] for key in date_keys])
+        for csv_name, site_ids, aoi_slice in zip(csv_names, aoi_ids, aoi_slices):
+            time_series_aoi.write_time_series(dl_dir, prdct, ts_start, ts_end, csv_name,
+                                              site_ids, date_keys, all_values[aoi_slice])
+
+    for ul, lr in aoi_boxes:
+        coords = viz_grace.aoi_coords(ul, lr)
+        make_gif.make_gif(png_dir=os.path.join(dl_dir, 'map_exports', coords),
+                          gif_dir=os.path.join(dl_dir, 'gif/'))
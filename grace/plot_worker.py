@@ -0,0 +1,10 @@
+"""Initializer for the process pools that draw with pyplot. It lives on its own rather than in
+viz_grace so that starting a pool (in the parent, and in every worker under spawn) doesn't
+import Basemap just to pick the backend."""
+
+import matplotlib.pyplot as plt
+
+
+def init_worker():
+    # render workers have no display, so force the non-interactive backend
+    plt.switch_backend('Agg')
@@ -0,0 +1,146 @@
+"""This module computes statistics over a whole AOI image stack in one streaming pass,
+one frame in memory at a time, so that every map of the stack (and the difference maps)
+can share a single, data-driven colour stretch instead of a hard-coded one.
+Running min/max and mean/std use the parallel (Chan et al.) update, and percentiles come
+from a mergeable quantile summary: each frame contributes a fixed number of weighted
+quantile points, partial results from different workers can simply be merged, and
+every merge compacts the summary back to that fixed size."""
+
+import os
+import json
+import numpy as np
+
+# quantile points kept in the summary
+SUMMARY_POINTS = 256
+# percentiles used for the stretch, clipping the extreme tails
+STRETCH_PERCENTILES = (2, 98)
+
+
+def new_stats():
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': np.inf, 'max': -np.inf,
+            'q_values': np.empty(0), 'q_weights': np.empty(0)}
+
+
+def update_stats(stats, values):
+    # add a frame's values (any shape, NaN/masked ignored) to the running stats
+    values = np.ma.filled(np.ma.asarray(values, dtype=float), np.nan).ravel()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return stats
+
+    frame = {'count': values.size, 'mean': values.mean(), 'm2': ((values - values.mean()) ** 2).sum(),
+             'min': values.min(), 'max': values.max()}
+
+    # evenly spaced quantiles of the frame, each standing for an equal share of its values
+    n_points = min(SUMMARY_POINTS, values.size)
+    frame['q_values'] = np.quantile(values, (np.arange(n_points) + 0.5) / n_points)
+    frame['q_weights'] = np.full(n_points, values.size / n_points)
+    return merge_stats(stats, frame)
+
+
+def merge_stats(a, b):
+    # combine two partial results, e.g. from different workers or stack chunks
+    if a['count'] == 0:
+        return dict(b)
+    if b['count'] == 0:
+        return dict(a)
+
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    q_values, q_weights = compact(np.concatenate([a['q_values'], b['q_values']]),
+                                  np.concatenate([a['q_weights'], b['q_weights']]))
+    return {'count': count,
+            'mean': a['mean'] + delta * b['count'] / count,
+            'm2': a['m2'] + b['m2'] + delta ** 2 * a['count'] * b['count'] / count,
+            'min': min(a['min'], b['min']),
+            'max': max(a['max'], b['max']),
+            'q_values': q_values,
+            'q_weights': q_weights}
+
+
+def summary_positions(q_values, q_weights):
+    # sorted points and the quantile (0-1) each stands at: the middle of the share of
+    # values it stands for
+    order = np.argsort(q_values)
+    q_weights = np.asarray(q_weights)[order]
+    cum_weights = np.cumsum(q_weights)
+    return np.asarray(q_values)[order], (cum_weights - q_weights / 2) / cum_weights[-1], cum_weights[-1]
+
+
+def compact(q_values, q_weights, n_points=SUMMARY_POINTS):
+    # resample a summary to n_points evenly spaced quantiles of equal weight, so its size
+    # stays fixed however many frames are merged into it
+    if len(q_values) <= n_points:
+        return q_values, q_weights
+    sorted_values, positions, total = summary_positions(q_values, q_weights)
+    targets = (np.arange(n_points) + 0.5) / n_points
+    return np.interp(targets, positions, sorted_values), np.full(n_points, total / n_points)
+
+
+def stats_percentile(stats, q):
+    # approximate q-th percentile (0-100) from the weighted quantile summary
+    if stats['count'] == 0:
+        return np.nan
+    sorted_values, positions, total = summary_positions(stats['q_values'], stats['q_weights'])
+    return float(np.interp(q / 100.0, positions, sorted_values))
+
+
+def summarize(stats):
+    # the plain numbers worth caching and showing
+    std = np.sqrt(stats['m2'] / stats['count']) if stats['count'] > 0 else np.nan
+    low, high = STRETCH_PERCENTILES
+    return {'count': int(stats['count']), 'min': float(stats['min']), 'max': float(stats['max']),
+            'mean': float(stats['mean']), 'std': float(std),
+            'p_low': stats_percentile(stats, low), 'p_high': stats_percentile(stats, high)}
+
+
+def file_keys(file_paths):
+    # [name, mtime_ns, size] of every file, so a month re-downloaded under the same
+    # name invalidates a cached summary
+    keys = []
+    for file_path in file_paths:
+        st = os.stat(file_path)
+        keys.append([os.path.basename(file_path), st.st_mtime_ns, st.st_size])
+    return keys
+
+
+def stack_summary(frames, file_paths, cache_path=None):
+    # one pass over the frames (any iterable, e.g. a generator reading one AOI window at
+    # a time) read from file_paths. The summary is cached at cache_path and reused,
+    # without touching frames, as long as the stack is made of the same, unchanged files.
+    keys = file_keys(file_paths)
+    if cache_path is not None and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached['files'] == keys:
+                return cached['stats']
+        except (ValueError, KeyError):
+            pass
+
+    print(f'computing stack statistics over {len(keys)} frames')
+    stats = new_stats()
+    for frame in frames:
+        stats = update_stats(stats, frame)
+    summary = summarize(stats)
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump({'files': keys, 'stats': summary}, f)
+    return summary
+
+
+def stretch_from_stats(summary, symmetric=False):
+    # (vmin, vmax) colour stretch; symmetric around 0 for difference maps. None when the
+    # stack has no valid values (e.g. an all-ocean AOI) or they are all the same, in which
+    # case the maps keep their default stretch.
+    stretch_min, stretch_max = summary['p_low'], summary['p_high']
+    if summary['count'] == 0 or not np.isfinite([stretch_min, stretch_max]).all():
+        return None
+    if symmetric:
+        half = max(abs(stretch_min), abs(stretch_max))
+        stretch_min, stretch_max = -half, half
+    if stretch_min == stretch_max:
+        return None
+    return stretch_min, stretch_max
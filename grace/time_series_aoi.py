@@ -7,10 +7,21 @@ import os, glob, sys, csv
 import numpy as np
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from cycler import cycler
 import matplotlib.pyplot as plt
 from osgeo import gdal
 
+# modules in this package
+from grace import workspace_index
+from grace import data_cube
+from grace import extract_cache
+from grace import climatology
+from grace import plot_worker
+
+# above this many window pixels per sampled site, read the sites pixel by pixel instead
+WINDOW_PIXELS_PER_SITE = 256
+
 
 def tif_to_np(tif_fname):
     # read datasource to np array
@@ -20,8 +31,12 @@ def tif_to_np(tif_fname):
     return data_np
 
 
-def make_prod_list(in_dir, prdct, year, day):
+def make_prod_list(in_dir, prdct, year, day, index=None):
     # return a list of product file names
+    # with a prebuilt workspace index this is a dict lookup rather than a glob
+    if index is not None:
+        return workspace_index.lookup(index, in_dir, prdct, year, day)
+
     if 'GRD-3' in prdct:
         t_file_list = glob.glob(os.path.join(in_dir,
                                              '{prdct}*_{year}{day}*.tif'.format(prdct=prdct,
@@ -49,50 +64,83 @@ def make_prod_list(in_dir, prdct, year, day):
     return t_file_list
 
 
-def extract_pixel_values(sites_dict, t_file_day):
-    #
-    ds = gdal.Open(t_file_day)
-    gt = ds.GetGeoTransform()
+def read_sites(csv_path):
+    # read the id,lat,lon sample csv (no headers) into numpy arrays, once per run
+    sites_dict = {}
+    with open(csv_path, mode='r') as sites_csv:
+        reader = csv.reader(sites_csv)
+        for row in reader:
+            key = row[0]
+            sites_dict[key] = row[1:]
+
+    site_ids = list(sites_dict.keys())
+    lats = np.array([float(v[0]) for v in sites_dict.values()])
+    lons = np.array([float(v[1]) for v in sites_dict.values()])
+    return site_ids, lats, lons
+
+
+def sites_to_rc(lats, lons, gt, nrows, ncols):
+    # convert all site coords to pixel row/col at once, plus a mask of the
+    # sites that actually fall on the raster
     xres = float(gt[1])
     yres = float(gt[5]) * -1
     xmin = float(gt[0])
     ymax = float(gt[3])
 
-    # get array and mask out nodata values
-    tif = ds.ReadAsArray()
+    cols = np.floor((lons - xmin) / xres).astype(int)
+    rows = np.floor((ymax - lats) / yres).astype(int)
+    valid = (rows >= 0) & (rows < nrows) & (cols >= 0) & (cols < ncols)
+    return rows, cols, valid
+
 
-    # this NoData value is specific to GRACE/GRACEFO
-    tif_np_masked = np.ma.masked_array(tif, tif == -99999.0)
+def extract_site_values(lats, lons, t_file_day):
+    # return an array with the pixel value at every site, NaN for NoData or off-raster
+    ds = gdal.Open(t_file_day)
+    rows, cols, valid = sites_to_rc(lats, lons, ds.GetGeoTransform(), ds.RasterYSize, ds.RasterXSize)
+
+    # read only what the sites need rather than the whole raster: the bounding window
+    # of all sites, or the single pixels if the sites are so spread out that the
+    # window would be mostly wasted
+    results = np.full(lats.shape, np.nan)
+    if valid.any():
+        rows, cols = rows[valid], cols[valid]
+        row0, col0 = rows.min(), cols.min()
+        ysize, xsize = rows.max() - row0 + 1, cols.max() - col0 + 1
+
+        if xsize * ysize <= WINDOW_PIXELS_PER_SITE * rows.size:
+            window = ds.ReadAsArray(int(col0), int(row0), int(xsize), int(ysize))
+            values = window[rows - row0, cols - col0].astype(float)
+        else:
+            values = np.array([ds.ReadAsArray(int(col), int(row), 1, 1)[0, 0]
+                               for row, col in zip(rows, cols)], dtype=float)
 
-    # look through list of sample sites in csv to extract data for all
-    rc_list = []
-    for site in sites_dict.items():
-        col = int(((float(site[1][1])) - xmin) / xres)
-        row = int((ymax - float(site[1][0])) / yres)
+        # this NoData value is specific to GRACE/GRACEFO
+        values[values == -99999.0] = np.nan
+        results[valid] = values
+    ds = None
 
-        rc_list.append((row, col))
+    return results
 
-    # create and return a list of results for all sites at the given date
-    results = []
-    for rc in rc_list:
-        try:
-            result = tif_np_masked[rc]
-            results.append(result)
-        except IndexError:
-            # print('No raster value for this pixel/date')
-            results.append(np.nan)
-    results = np.ma.filled(results, fill_value=np.nan)
-    tif = None
 
+def extract_cube_matrix(cube, meta, lats, lons, time_idx):
+    # a sites x time steps matrix of pixel values gathered from the data cube, NaN for
+    # NoData or off-raster sites as in extract_site_values
+    rows, cols, valid = sites_to_rc(lats, lons, meta['gt'], *meta['shape'][1:])
+
+    results = np.full((lats.size, len(time_idx)), np.nan)
+    if valid.any() and len(time_idx) > 0:
+        # the gather is the only copy; the NoData check runs on the gathered values only
+        values = cube[np.asarray(time_idx)[:, None], rows[valid], cols[valid]].T
+        results[valid] = np.where(values == meta['nodata'], np.nan, values)
     return results
 
 
 def box_plot(years, aoi_name, csv_path):
     # Quck boxplot for each year
-    overall_mean = round(years.stack().mean(), 2)
-    overall_min = round(years.stack().min(), 2)
-    overall_max = round(years.stack().max(), 2)
     data_to_plot = years.to_numpy()
+    overall_mean = round(float(np.nanmean(data_to_plot)), 2)
+    overall_min = round(float(np.nanmin(data_to_plot)), 2)
+    overall_max = round(float(np.nanmax(data_to_plot)), 2)
 
     # Filter out the NaNs, otherwise the boxplot is unhappy
     # https://stackoverflow.com/questions/44305873/how-to-deal-with-nan-value-when-plot-boxplot-using-python
@@ -172,8 +220,10 @@ def box_plot(years, aoi_name, csv_path):
     plt.close(fig_box)
 
 
-def overpost_all_plot(years, aoi_name, csv_path):
+def overpost_all_plot(years, aoi_name, csv_path, clim=None):
     ### Create a plot where all the years are combined in a single graph
+    # years is a DOY x year frame (see climatology.years_frame); clim its climatology,
+    # computed here if not given
     fig_comb = plt.figure(figsize=(10, 5))
     fig_comb.set_facecolor('black')
     ax_comb = fig_comb.add_subplot(111)
@@ -187,32 +237,27 @@ def overpost_all_plot(years, aoi_name, csv_path):
     plt.rc('lines', linewidth=0.5)
     ax_comb.set_prop_cycle(c)
 
-    min_display = 0
-    max_display = 0
-
-    data_climo = pd.DataFrame()
-    data_climo['mean'] = years.mean(axis=1)
-
-    # Add each year to same plot -- for some reason a 'undefined' values comes back first, so
-    # check for year part first
-    for ycol in years.columns:
-        if '20' in ycol:
-            if years[ycol].max() > max_display:
-                max_display = years[ycol].max()
-            if years[ycol].min() < min_display:
-                min_display = years[ycol].min()
-
-            s1mask = np.isfinite(years[ycol])
-            ax_comb.plot(years.index[s1mask],
-                         years[ycol][s1mask],
-                         label=str(ycol),
-                         marker='o',
-                         ms=4,
-                         linestyle='dashed')
-
-    s2mask = np.isfinite(data_climo['mean'])
-    ax_comb.plot(data_climo.index[s2mask],
-                 data_climo['mean'][s2mask],
+    data = years.to_numpy()
+    if clim is None:
+        clim = climatology.climatology(data, percentiles=())
+
+    # display range always includes 0
+    min_display = min(0.0, float(np.nanmin(clim['min'])))
+    max_display = max(0.0, float(np.nanmax(clim['max'])))
+
+    # Add each year to same plot
+    for i_col, ycol in enumerate(years.columns):
+        s1mask = np.isfinite(data[:, i_col])
+        ax_comb.plot(years.index[s1mask],
+                     data[s1mask, i_col],
+                     label=str(ycol),
+                     marker='o',
+                     ms=4,
+                     linestyle='dashed')
+
+    s2mask = np.isfinite(clim['mean'])
+    ax_comb.plot(years.index[s2mask],
+                 clim['mean'][s2mask],
                  label='Mean for period',
                  marker='o',
                  ms=4,
@@ -275,121 +320,266 @@ def convert_to_doy(doy):
         sys.exit(1)
 
 
-def make_time_series_plots(base_dir, prdct, start_date, end_date, csv_name):
+def stack_sites(aoi_sites):
+    # concatenate the (lats, lons) of several AOIs so each raster is read once for all
+    # of them; returns the stacked coords and the slice of every AOI within them
+    all_lats = np.concatenate([lats for lats, lons in aoi_sites])
+    all_lons = np.concatenate([lons for lats, lons in aoi_sites])
+    ends = np.cumsum([lats.size for lats, lons in aoi_sites])
+    aoi_slices = [slice(int(end - lats.size), int(end)) for end, (lats, lons) in zip(ends, aoi_sites)]
+    return all_lats, all_lons, aoi_slices
+
+
+def extract_aoi_values(t_file, all_lats, all_lons, aoi_slices, site_keys, cache=None):
+    # values of t_file at the stacked sites of all AOIs (see stack_sites). Each AOI is
+    # taken from the extraction cache if it has it, under its own site_keys entry, and
+    # the AOIs that aren't are read together in one pass and cached.
+    # Returns the values and whether the raster had to be read.
+    values = np.full(all_lats.size, np.nan)
+    missing = list(range(len(aoi_slices)))
+    if cache is not None:
+        missing = []
+        for i_aoi, site_key in enumerate(site_keys):
+            cached = extract_cache.get_values(cache, t_file, site_key)
+            if cached is None:
+                missing.append(i_aoi)
+            else:
+                values[aoi_slices[i_aoi]] = cached
+    if not missing:
+        return values, False
+
+    rows = np.concatenate([np.arange(all_lats.size)[aoi_slices[i]] for i in missing])
+    values[rows] = extract_site_values(all_lats[rows], all_lons[rows], t_file)
+    if cache is not None:
+        for i_aoi in missing:
+            extract_cache.put_values(cache, t_file, site_keys[i_aoi], values[aoi_slices[i_aoi]])
+    return values, True
+
+
+def extract_aois(base_dir, prdct, start_date, end_date, aoi_sites, use_cube=False, progress=None, use_cache=True):
+    # sample every AOI from a single read of each raster. aoi_sites is a list of
+    # (lats, lons) arrays, one per AOI; the sites are concatenated so that each raster
+    # is opened once, and the results are split back into one sites x dates matrix per AOI.
+    # Returns the yyyyddd keys of the rasters and the list of matrices.
+    # With use_cube the values are gathered from the workspace data cube in one go.
+    # progress, if given, is called as progress(done, total) after every raster.
+    # use_cache keeps the values of each AOI per raster on disk (see extract_cache), so a
+    # re-run only reads the rasters that were added or changed since the last one.
+    all_lats, all_lons, aoi_slices = stack_sites(aoi_sites)
+    splits = [aoi_slice.stop for aoi_slice in aoi_slices[:-1]]
+
+    cube = data_cube.open_cube(base_dir, prdct) if use_cube else None
+    if cube is not None:
+        cube, meta = cube
+        time_idx, date_keys = data_cube.dates_in_range(meta, start_date, end_date)
+        print(f'extracting values for {len(date_keys)} dates from the data cube')
+        all_values = extract_cube_matrix(cube, meta, all_lats, all_lons, time_idx)
+        return date_keys, np.split(all_values, splits, axis=0)
+
+    # index the workspace once, rather than globbing it for every date
+    index = workspace_index.build_index(base_dir)
+
+    # Loop through the dates that actually have a raster in the workspace; days without
+    # data are filled with NaN later by a reindex, so the work scales with the number of
+    # files rather than the number of days.
+    date_keys = workspace_index.dates_in_range(index, prdct, start_date, end_date)
+    print(f'extracting values for {len(date_keys)} dates')
+
+    all_values = np.full((all_lats.size, len(date_keys)), np.nan)
+
+    cache = extract_cache.open_cache(base_dir) if use_cache else None
+    site_keys = [extract_cache.sites_hash(lats, lons) for lats, lons in aoi_sites]
+    n_read = 0
+
+    try:
+        for i_day, date_key in enumerate(date_keys):
+            year, day = date_key[:4], date_key[4:]
+            # Open the ONLY BAND IN THE TIF! Cannot currently deal with multiband tifs
+            t_file_list = make_prod_list(base_dir, prdct, year, day, index)
+
+            if len(t_file_list) > 1:
+                print('Multiple matching files found for same date! Please remove one.')
+                sys.exit(1)
+
+            try:
+                all_values[:, i_day], was_read = extract_aoi_values(t_file_list[0], all_lats, all_lons,
+                                                                    aoi_slices, site_keys, cache)
+            except Exception:
+                # print('Warning! Pixel out of raster boundaries!')
+                pass
+            else:
+                n_read += was_read
+            if progress is not None:
+                progress(i_day + 1, len(date_keys))
+    finally:
+        if cache is not None:
+            extract_cache.close_cache(cache)
+
+    if cache is not None:
+        print(f'{n_read} rasters read, {len(date_keys) - n_read} served from the extraction cache')
+
+    # split the stacked sites back out per AOI
+    return date_keys, np.split(all_values, splits, axis=0)
+
+
+def write_columnar(site_ids, date_keys, site_matrix, out_path, fmt='parquet'):
+    # dates x sites table with a datetime index and one float column per site, in a typed
+    # columnar format so it loads back without any date or number parsing.
+    # Needs pyarrow (both formats).
+    site_df = pd.DataFrame(np.asarray(site_matrix, dtype=np.float64).T,
+                           index=pd.to_datetime(date_keys, format='%Y%j'),
+                           columns=[str(site_id) for site_id in site_ids])
+    site_df.index.name = 'date'
+    try:
+        if fmt == 'parquet':
+            site_df.to_parquet(out_path)
+        elif fmt == 'feather':
+            # feather can't hold an index, so the dates go in a column
+            site_df.reset_index().to_feather(out_path)
+        else:
+            raise ValueError(f'unknown columnar format {fmt}, use parquet or feather')
+    except ImportError:
+        print(f'pyarrow is needed for {fmt} output, skipping {out_path}')
+        return None
+    return out_path
+
+
+def read_time_series(path):
+    # load a per site time series back as a dates x sites DataFrame with a datetime index.
+    # Parquet/feather come back typed as written; the _per_site.csv is parsed as a fallback.
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        site_df = pd.read_parquet(path)
+    elif ext == '.feather':
+        site_df = pd.read_feather(path).set_index('date')
+    else:
+        site_df = pd.read_csv(path, index_col='site', dtype={'site': str}).T
+        site_df.index = pd.to_datetime(site_df.index, format='%Y%j')
+        site_df.index.name = 'date'
+    # the same labels whatever the format
+    site_df.columns.name = 'site'
+    return site_df
+
+
+def write_time_series(base_dir, prdct, start_date, end_date, csv_name, site_ids, date_keys, site_matrix,
+                      columnar=None):
+    # write the csvs and graphs for one AOI from its sites x dates matrix.
+    # columnar ('parquet' or 'feather') also writes the per site values in that format.
     aoi_name = os.path.basename(csv_name[:-4])
-    aoi_names = csv_name
     fig_dir = os.path.join(base_dir, 'graphs')
+    sites_csv_input = os.path.join(base_dir, csv_name)
 
     if not os.path.exists(fig_dir):
-        os.makedirs(fig_dir)
-
-    years = [year for year in range(start_date.year, end_date.year+1)]
+        os.makedirs(fig_dir, exist_ok=True)
 
     dt_indx = pd.date_range(start_date, end_date)
-    strt_year = dt_indx[0].to_pydatetime().year
-    end_year = dt_indx[-1].to_pydatetime().year
-
-    # var never gets used?
-    nyears = end_year - strt_year
-
-    sites_csv_input = os.path.join(base_dir, csv_name)
-    sites_dict = {}
-    with open(sites_csv_input, mode='r') as sites_csv:
-        reader = csv.reader(sites_csv)
-        for row in reader:
-            key = row[0]
-            sites_dict[key] = row[1:]
-
-    #print(sites_dict.items())
 
-    # Loop through the years provided, and extract the pixel values at the provided coordinates. Outputs CSV and figs.
-    smpl_results_df = pd.DataFrame(columns=['yyyyddd', 'value'])
-    for year in years:
-        print(f"extracting values for year: {year}")
-        doy_list = []
-        if check_leap(year):
-            for i in range(1, 367):
-                doy_list.append(convert_to_doy(i))
-        else:
-            for i in range(1, 366):
-                doy_list.append(convert_to_doy(i))
+    # mean across the sites for each date, ignoring nans; all-nan dates stay nan
+    counts = np.sum(~np.isnan(site_matrix), axis=0)
+    sums = np.nansum(site_matrix, axis=0)
+    mean_values = np.full(len(date_keys), np.nan)
+    np.divide(sums, counts, out=mean_values, where=counts > 0)
 
-        # Loop through each site and extract the pixel values
-        for day in doy_list:
-            # Open the ONLY BAND IN THE TIF! Cannot currently deal with multiband tifs
-            t_file_list = make_prod_list(base_dir, prdct, year, day)
-
-            file_name = '{in_dir}/{prdct}*_{year}{day}*.tif'.format(in_dir=base_dir,
-                                                                        prdct=prdct,
-                                                                        day=day,
-                                                                        year=year)
-
-            # See if there is a raster for the date, if not use a fill value for the graph
-            if len(t_file_list) == 0:
-                # print('File not found: ' + file_name)
-                pixel_values = [np.nan] * len(sites_dict)
-                new_row = {'yyyyddd': str(year) + str(day), 'value': pixel_values[0]}
-                smpl_results_df = smpl_results_df.append(new_row, ignore_index=True)
-            elif len(t_file_list) > 1:
-                print('Multiple matching files found for same date! Please remove one.')
-                sys.exit(1)
-            else:
-                # print('Found file: ' + file_name)
-                t_file_day = t_file_list[0]
-                # Extract pixel values and append to dataframe
-                try:
-                    pixel_values = extract_pixel_values(sites_dict, t_file_day)
-
-                    # remove any nans, then report mean across the rows for table
-                    pixel_values = pixel_values[~np.isnan(pixel_values)]
-                    new_row = {'yyyyddd': str(year)+str(day), 'value': pixel_values.mean()}
-                    smpl_results_df = smpl_results_df.append(new_row, ignore_index=True)
-                except:
-                    # print('Warning! Pixel out of raster boundaries!')
-                    pixel_values = [np.nan] * len(sites_dict)
-                    new_row = {'yyyyddd': str(year)+str(day), 'value': pixel_values[0]}
-                    smpl_results_df = smpl_results_df.append(new_row, ignore_index=True)
+    # fill the days between files with NaN so the table still has one row per day
+    smpl_results_df = pd.DataFrame({'value': mean_values},
+                                   index=pd.to_datetime(date_keys, format='%Y%j'))
+    smpl_results_df = smpl_results_df.reindex(dt_indx)
+    smpl_results_df.insert(0, 'yyyyddd', dt_indx.strftime('%Y%j'))
 
     # Export data to csv
-    os.chdir(fig_dir)
-    file_name = sites_csv_input.split(sep='/')[-1]
+    file_name = os.path.basename(sites_csv_input)
     output_name = str(os.path.join(fig_dir, file_name[:-4] + '_extracted_values'))
     csv_name = str(output_name + '_' + prdct + '_' + str(start_date.year) + str(start_date.month) +
                    '_' + str(end_date.year) + '_' + str(end_date.month) + '.csv')
     print('writing csv: ' + csv_name)
     smpl_results_df.to_csv(csv_name, index=False)
 
-    # rejig the date
-    smpl_results_df['date'] = pd.to_datetime(smpl_results_df['yyyyddd'],
-                                             format='%Y%j')
-    smpl_results_df.set_index('date', inplace=True)
-    smpl_results_df.drop(['yyyyddd'], axis=1)
-    smpl_results_df = smpl_results_df.groupby('date').mean()
-
-    # prep the dataset to be split into columns, one per year
-    series = smpl_results_df.squeeze()
-    series = series.reindex(dt_indx, fill_value=np.NaN)
-    groups = series.groupby(pd.Grouper(freq='A'))
-    years_df = pd.DataFrame()
-
-    for name, group in groups:
-        if len(group.values) > 1:
-            try:
-                years_df[name.year] = group.values[:364]
-            except:
-                print('incomplete data!')
-
-    # drop any years that have no data at all
-    years_df = years_df.dropna(axis=1, how='all')
-
-    # make columns into strings for easier plot labeling
-    years_df.columns = years_df.columns.astype(str)
+    if len(date_keys) == 0:
+        print(f'No data for {aoi_name} in this date range, skipping the graphs')
+        return
+
+    # full sites x dates matrix, one row per site
+    site_matrix_df = pd.DataFrame(site_matrix, index=site_ids, columns=date_keys)
+    site_matrix_df.index.name = 'site'
+    site_csv_name = csv_name[:-4] + '_per_site.csv'
+    print('writing csv: ' + site_csv_name)
+    site_matrix_df.to_csv(site_csv_name)
+
+    if columnar is not None:
+        columnar_name = csv_name[:-4] + '_per_site.' + columnar
+        print('writing ' + columnar + ': ' + columnar_name)
+        write_columnar(site_ids, date_keys, site_matrix, columnar_name, columnar)
+
+    # every site's departure from its own monthly climatology, all sites in one pass
+    anomaly_df = pd.DataFrame(climatology.series_anomaly(date_keys, site_matrix, by='month'),
+                              index=site_ids, columns=date_keys)
+    anomaly_df.index.name = 'site'
+    anomaly_csv_name = csv_name[:-4] + '_per_site_anomaly.csv'
+    print('writing csv: ' + anomaly_csv_name)
+    anomaly_df.to_csv(anomaly_csv_name)
+
+    # monthly climatology of the AOI mean, since the tiles are monthly
+    month_matrix, month_years = climatology.month_year_matrix(date_keys, mean_values)
+    month_df = climatology.climatology_frame(climatology.climatology(month_matrix),
+                                             pd.Index(np.arange(1, 13), name='month'))
+    clim_csv_name = csv_name[:-4] + '_climatology.csv'
+    print('writing csv: ' + clim_csv_name)
+    month_df.to_csv(clim_csv_name)
+
+    # DOY x year matrix of the AOI mean in one reshape, with its climatology
+    years_df = climatology.years_frame(date_keys, mean_values)
+    if years_df.empty:
+        print(f'No valid values for any site of {aoi_name}, skipping the graphs')
+        return
+    clim = climatology.climatology(years_df.to_numpy())
 
     # make the plots
-    overpost_all_plot(years_df, aoi_name, sites_csv_input)
+    overpost_all_plot(years_df, aoi_name, sites_csv_input, clim)
     box_plot(years_df, aoi_name, sites_csv_input)
 
 
+def make_time_series_batch(base_dir, prdct, start_date, end_date, csv_names, max_workers=None, use_cube=False,
+                           progress=None, use_cache=True, columnar=None):
+    # run the time series for many AOI csvs against the same raster stack: each raster
+    # is read once for all AOIs, then the csvs and graphs are made per AOI on a process pool
+    if len(csv_names) == 0:
+        print('No sample csvs given, nothing to do.')
+        return
+
+    aoi_sites = []
+    aoi_ids = []
+    for csv_name in csv_names:
+        site_ids, lats, lons = read_sites(os.path.join(base_dir, csv_name))
+        aoi_ids.append(site_ids)
+        aoi_sites.append((lats, lons))
+
+    date_keys, site_matrices = extract_aois(base_dir, prdct, start_date, end_date, aoi_sites, use_cube, progress,
+                                            use_cache)
+
+    jobs = [(base_dir, prdct, start_date, end_date, csv_name, site_ids, date_keys, site_matrix, columnar)
+            for csv_name, site_ids, site_matrix in zip(csv_names, aoi_ids, site_matrices)]
+
+    # a single AOI isn't worth the pool start-up
+    if max_workers == 1 or len(jobs) == 1:
+        for job in jobs:
+            write_time_series(*job)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=plot_worker.init_worker) as executor:
+        futures = {executor.submit(write_time_series, *job): job[4] for job in jobs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f'Time series failed for {futures[future]}: {e}')
+
+
+def make_time_series_plots(base_dir, prdct, start_date, end_date, csv_name, use_cube=False, progress=None,
+                           use_cache=True, columnar=None):
+    make_time_series_batch(base_dir, prdct, start_date, end_date, [csv_name], max_workers=1, use_cube=use_cube,
+                           progress=progress, use_cache=use_cache, columnar=columnar)
+
+
 if __name__ == '__main__':
     base_dir = '/home/arthur/Dropbox/career/e84/sample_data/'
     #base_dir = r'C:\Users\arthu\Dropbox\career\e84\sample_data'
@@ -7,9 +7,7 @@ import matplotlib.pyplot as plt
 import os
 
 # some odd error with the basemap data
-try:
-    print(os.environ['PROJ_LIB'])
-except:
+if 'PROJ_LIB' not in os.environ:
     os.environ["PROJ_LIB"] = r"C:\Users\arthu\Anaconda3\envs\e84_win\Library\share\proj"
 
 import numpy as np
@@ -17,8 +15,25 @@ from mpl_toolkits.basemap import Basemap
 from osgeo import osr
 from osgeo import gdal
 import glob
+import hashlib
+import tempfile
+import functools
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor
 
 from grace import make_gif
+from grace import data_cube
+from grace import stack_stats
+from grace import plot_worker
+
+# Basemap and projected grid per (ul, lr, source SRS, geotransform), shared by
+# every frame of an AOI stack and by img_diff
+GRID_CACHE = {}
+# figure template per AOI and stretch for reuse_figure rendering
+FIGURE_CACHE = {}
+# colour stretch used when none is computed from the stack
+DEFAULT_STRETCH = (-0.25, 0.25)
 
 
 def convert_xy(xy_source, inproj, outproj):
@@ -39,97 +54,300 @@ def convert_xy(xy_source, inproj, outproj):
     return xx, yy
 
 
-def img_to_arr(img):
+def make_basemap(ul_coord, lr_coord):
+    xmin = ul_coord[1]
+    xmax = lr_coord[1]
+    ymax = ul_coord[0]
+    ymin = lr_coord[0]
+
+    # TODO figure out weird quirk in central longitude
+    m = Basemap(projection='laea',
+                llcrnrlat=ymin,
+                urcrnrlat=ymax,
+                llcrnrlon=xmin,
+                urcrnrlon=xmax,
+                lon_0=((xmax+xmin)/2),
+                lat_0=ymax+10,
+                lat_1=((ymax+ymin)/2),
+                lat_2=ymin-10,
+                resolution='c')
+    return m
+
+
+def get_map_grid(ul_coord, lr_coord, proj, gt, shape, cache_dir=None):
+    # return the Basemap and the projected xx, yy plotting grid for the AOI, given the
+    # geotransform and shape of the AOI window (see read_aoi). Both are the same for every
+    # frame with the same AOI, SRS and geotransform, so they are built once per process;
+    # the grid can also be persisted to cache_dir as an .npz file.
+    key = (tuple(ul_coord), tuple(lr_coord), proj, tuple(gt), tuple(shape))
+    if key in GRID_CACHE:
+        return GRID_CACHE[key]
+
+    m = make_basemap(ul_coord, lr_coord)
+
+    grid_name = None
+    if cache_dir is not None:
+        grid_name = os.path.join(cache_dir, 'grid_' + hashlib.md5(repr(key).encode()).hexdigest())
+    if grid_name is not None and os.path.isfile(grid_name + '.npz'):
+        with np.load(grid_name + '.npz') as grid:
+            xx, yy = grid['xx'], grid['yy']
+    else:
+        # make grid of the pixel corner coords for plotting, one more than the
+        # data in each direction, from the window geotransform at any resolution
+        ys = gt[3] + gt[5] * np.arange(shape[0] + 1)
+        xs = gt[0] + gt[1] * np.arange(shape[1] + 1)
+        xy_source = np.array(np.meshgrid(ys, xs, indexing='ij'))
+        inproj = osr.SpatialReference()
+        inproj.ImportFromWkt(proj)
+        outproj = osr.SpatialReference()
+        outproj.ImportFromProj4(m.proj4string)
+        xx, yy = convert_xy(xy_source, inproj, outproj)
+
+        if grid_name is not None:
+            # other workers may be loading the grid right now, so write xx and yy together
+            # to a private temp file and swap it into place in one step
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.npz', delete=False) as f:
+                np.savez(f, xx=xx, yy=yy)
+            os.replace(f.name, grid_name + '.npz')
+
+    GRID_CACHE[key] = (m, xx, yy)
+    return m, xx, yy
+
+
+def aoi_coords(ul_coord, lr_coord):
+    # AOI part of output names, e.g. -10_100_-45_160
+    return '_'.join([str(ul_coord[0]), str(ul_coord[1]), str(lr_coord[0]), str(lr_coord[1])])
+
+
+def aoi_window(gt, ul_coord, lr_coord, nrows, ncols):
+    # pixel window (xoff, yoff, xsize, ysize) covering the AOI, derived from the
+    # geotransform so it works at any resolution, clipped to the raster
+    xmin = ul_coord[1]
+    xmax = lr_coord[1]
+    ymax = ul_coord[0]
+    ymin = lr_coord[0]
+
+    col0 = int(np.floor((xmin - gt[0]) / gt[1] + 1e-9))
+    col1 = int(np.ceil((xmax - gt[0]) / gt[1] - 1e-9))
+    row0 = int(np.floor((ymax - gt[3]) / gt[5] + 1e-9))
+    row1 = int(np.ceil((ymin - gt[3]) / gt[5] - 1e-9))
+
+    col0, col1 = max(col0, 0), min(col1, ncols)
+    row0, row1 = max(row0, 0), min(row1, nrows)
+    return col0, row0, col1 - col0, row1 - row0
+
+
+def window_geotransform(gt, window):
+    # geotransform of a (xoff, yoff, xsize, ysize) pixel window of a raster
+    xoff, yoff = window[:2]
+    return (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+            gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+
+
+def read_aoi(img, ul_coord, lr_coord, use_cube=False):
+    # read only the AOI window of img through GDAL; returns the window, its geotransform
+    # (not that of the whole raster) and the projection.
+    # With use_cube the window is sliced from the workspace data cube when it holds img.
+    if use_cube:
+        cube = data_cube.open_cube(os.path.dirname(os.path.abspath(img)))
+        if cube is not None:
+            cube, meta = cube
+            t = data_cube.time_index(meta, img)
+            if t is not None:
+                window = aoi_window(meta['gt'], ul_coord, lr_coord, *meta['shape'][1:])
+                return data_cube.read_aoi(cube, t, window), window_geotransform(meta['gt'], window), meta['proj']
+
     ds = gdal.Open(img)
-    arr = ds.ReadAsArray()
     gt = ds.GetGeoTransform()
+    window = aoi_window(gt, ul_coord, lr_coord, ds.RasterYSize, ds.RasterXSize)
+    arr = ds.ReadAsArray(*window)
     proj = ds.GetProjection()
     ds = None
-    return arr, gt, proj
-
-
-def make_all_plots(data_dir, ul, lr):
-    coords = '_'.join([str(ul[0]), str(ul[1]), str(lr[0]), str(lr[1])])
+    return arr, window_geotransform(gt, window), proj
+
+
+def aoi_stretch(data_dir, ul, lr, file_list, use_cube=False, symmetric=False):
+    # colour stretch from one streaming statistics pass over the AOI stack, cached per AOI
+    coords = aoi_coords(ul, lr)
+    cache_path = os.path.join(data_dir, 'map_exports', 'stats_' + coords + '.json')
+    frames = (data_cube.mask_nodata(read_aoi(file, ul, lr, use_cube)[0]) for file in file_list)
+    summary = stack_stats.stack_summary(frames, file_list, cache_path)
+    stretch = stack_stats.stretch_from_stats(summary, symmetric)
+    if stretch is None:
+        print(f'No valid values to stretch AOI {coords} by, using the default colour stretch.')
+    return stretch
+
+
+def render_frames(file_list, out_dir, ul, lr, cache_dir, reuse_figure, save_png, max_workers, use_cube=False,
+                  stretch=None):
+    # yield the rendered frames as RGBA arrays, in file order. With a process pool only a
+    # few frames are in flight at once, so a slow encoder doesn't pile up frames in memory.
+    render = functools.partial(make_plot, o_dir=out_dir, contrast_stretch=True, ul_coord=ul, lr_coord=lr,
+                               cache_dir=cache_dir, reuse_figure=reuse_figure, save_png=save_png,
+                               return_frame=True, use_cube=use_cube, stretch=stretch)
+    if max_workers == 1:
+        for file in file_list:
+            yield render(file)
+        close_figures()
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=plot_worker.init_worker) as executor:
+        in_flight = collections.deque()
+        files = iter(file_list)
+        for file in itertools.islice(files, 2 * (max_workers or os.cpu_count() or 1)):
+            in_flight.append(executor.submit(render, file))
+        while in_flight:
+            frame = in_flight.popleft().result()
+            for file in itertools.islice(files, 1):
+                in_flight.append(executor.submit(render, file))
+            yield frame
+
+
+def report_progress(items, total, progress=None):
+    # pass items through, calling progress(done, total) after each one is consumed
+    for i, item in enumerate(items):
+        yield item
+        if progress is not None:
+            progress(i + 1, total)
+
+
+def make_all_plots(data_dir, ul, lr, max_workers=None, reuse_figure=True, in_memory=False, save_png=True,
+                   use_cube=False, dynamic_stretch=False, progress=None, out_format='gif', scale=1.0,
+                   reuse_palette=False):
+    # max_workers=None uses all cores, 1 renders serially in this process.
+    # reuse_figure draws the map decorations once per process and only redraws the data per frame.
+    # in_memory hands the rendered canvases straight to the gif encoder instead of reading the
+    # PNGs back from disk, in which case writing the PNGs at all is optional (save_png).
+    # use_cube reads the frames from the workspace data cube (see data_cube.build_cube).
+    # dynamic_stretch sets the colour stretch from the statistics of the whole AOI stack.
+    # progress, if given, is called as progress(done, total) after every frame.
+    # out_format, scale and reuse_palette are passed on to the animation encoder (see make_gif).
+    coords = aoi_coords(ul, lr)
     out_dir = os.path.join(data_dir, 'map_exports', coords)
 
-    os.chdir(data_dir)
-
     # make output dir if it doesn't exist
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir, exist_ok=True)
 
-    # loop over all matching input files in workspace, create plot for each
-    for file in glob.glob(os.path.join(data_dir, "*JPLEM_BA01_0600_LND_*.tif")):
-        make_plot(file, out_dir, True, ul, lr)
+    # loop over all matching input files in workspace, create plot for each.
+    # Sorted so frames are always produced (and numbered) in date order.
+    file_list = sorted(glob.glob(os.path.join(data_dir, "*JPLEM_BA01_0600_LND_*.tif")))
+    cache_dir = os.path.join(data_dir, 'map_exports', 'grid_cache')
+    gif_dir = os.path.join(data_dir, 'gif/')
+
+    # the cube is checked once here rather than in every render worker
+    if use_cube and data_cube.open_cube(data_dir) is None:
+        use_cube = False
+
+    # one stretch for the whole stack, so the legend doesn't change over time
+    stretch = None
+    if dynamic_stretch:
+        stretch = aoi_stretch(data_dir, ul, lr, file_list, use_cube)
+
+    if in_memory:
+        gif_path = make_gif.animation_path(gif_dir, coords, out_format)
+        frames = render_frames(file_list, out_dir, ul, lr, cache_dir, reuse_figure, save_png, max_workers,
+                               use_cube, stretch)
+        make_gif.write_frames(report_progress(frames, len(file_list), progress), gif_path, scale=scale,
+                              reuse_palette=reuse_palette)
+        print(f'Animation created: {gif_path}')
+        return
+
+    render = functools.partial(make_plot, o_dir=out_dir, contrast_stretch=True, ul_coord=ul, lr_coord=lr,
+                               cache_dir=cache_dir, reuse_figure=reuse_figure, use_cube=use_cube,
+                               stretch=stretch)
+    if max_workers == 1:
+        try:
+            for file in report_progress(file_list, len(file_list), progress):
+                render(file)
+        finally:
+            close_figures()
+    else:
+        # each frame is an independent CPU-bound render, so fan them out over processes;
+        # map returns in input order and re-raises the first failure
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=plot_worker.init_worker) as executor:
+            futures = [executor.submit(render, file) for file in file_list]
+            try:
+                for future in report_progress(futures, len(futures), progress):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
 
     # make gif
     make_gif.make_gif(png_dir=out_dir,
-                      gif_dir=os.path.join(data_dir, 'gif/'))
+                      gif_dir=gif_dir,
+                      out_format=out_format,
+                      scale=scale,
+                      reuse_palette=reuse_palette)
+
 
+def png_path(img_file, o_dir, ul_coord, lr_coord):
+    # where make_plot saves the map of img_file for the AOI
+    return '{a}{b}_{c}_{d}.png'.format(a=o_dir + '/',
+                                       b=os.path.basename(img_file[:-4]),
+                                       c=str(ul_coord[0]) + 'N' + str(ul_coord[1]) + 'W_by',
+                                       d=str(lr_coord[0]) + 'N_' + str(lr_coord[1]) + 'W')
 
-def make_plot(img_file, o_dir, contrast_stretch, ul_coord, lr_coord):
+
+def make_plot(img_file, o_dir, contrast_stretch, ul_coord, lr_coord, cache_dir=None, reuse_figure=False,
+              save_png=True, return_frame=False, use_cube=False, stretch=None):
     print(f'making plot for {img_file}')
-    # use gdal to read in data as np array
-    data, gt, proj = img_to_arr(img_file)
+    # use gdal to read the AOI window in as np array
+    data, gt, proj = read_aoi(img_file, ul_coord, lr_coord, use_cube)
 
     # mask out the NoData
-    data = np.ma.masked_array(data, data == -99999.0)
-
-    # parse geotransform details
-    xres = gt[1]
-    yres = gt[5]
-    xmin = ul_coord[1]
-    xmax = lr_coord[1]
-    ymax = ul_coord[0]
-    ymin = lr_coord[0]
+    data = data_cube.mask_nodata(data)
 
-    m = Basemap(projection='laea',
-                llcrnrlat=ymin,
-                urcrnrlat=ymax,
-                llcrnrlon=xmin,
-                urcrnrlon=xmax,
-                lon_0=((xmax+xmin)/2),
-                lat_0=ymax+10,
-                lat_1=((ymax+ymin)/2),
-                lat_2=ymin-10,
-                resolution='c')
+    # projection and plotting grid are shared across the whole AOI stack
+    m, xx, yy = get_map_grid(ul_coord, lr_coord, proj, gt, data.shape, cache_dir)
 
-    # make grid of xy coords for plotting
-    # this also should handle coord systems other than lat/long
-    xy_source = np.mgrid[ymax:ymin - 1:yres, xmin:xmax + 1:xres]
-    inproj = osr.SpatialReference()
-    inproj.ImportFromWkt(proj)
-    outproj = osr.SpatialReference()
-    outproj.ImportFromProj4(m.proj4string)
-    xx, yy = convert_xy(xy_source, inproj, outproj)
-
-    # These to be implemented with any data with units that
-    # aren't degrees, unlike the GRACE gridded data
-    # row0, row1 = int((90 - ymax + xres) / xres), \
-    #              int((90 - ymin + xres) / yres)
-    # col0, col1 = int((180 + xmin) / gt[5]), \
-    #              int((180 + xmax) / gt[5])
-
-    # slice data based on user extent
-    # NOTE in future version, update this to account for pixel size
-    # other than 1 by simply:
-    #         col = int(long - xmin) / xres)
-    #         row = int((ymax - lat) / yres)
-    data = data[90 - ymax:90 - ymin, xmin + 180:xmax + 180]
+    title = 'GRACE Land Water-Equivalent-Thickness Surface Mass Anomaly Rel 6.0 v 03 for dates: ' + \
+            os.path.splitext(os.path.basename(img_file))[0][6:21]
+            #img_file.split('/')[-1][6:21]
+    stats_str = f'AOI Mean = {round(data.mean(), 2)} AOI STD DEV = {round(data.std(), 2)}'
 
+    # with reuse_figure the figure and its static decorations are built for the first
+    # frame of an AOI, and later frames only swap in the data, title and stats
+    key = (tuple(ul_coord), tuple(lr_coord), proj, tuple(gt), stretch)
+    if reuse_figure and key in FIGURE_CACHE:
+        frame = FIGURE_CACHE[key]
+        draw_frame(frame, data, title, stats_str)
+    else:
+        frame = make_figure(m, xx, yy, data, title, stats_str, stretch)
+        if reuse_figure:
+            FIGURE_CACHE[key] = frame
+
+    if save_png:
+        if not os.path.exists(o_dir):
+            os.makedirs(o_dir)
+
+        frame['fig'].savefig(png_path(img_file, o_dir, ul_coord, lr_coord))
+
+    # the canvas pixels, for feeding an animation encoder without a PNG round trip
+    rgba = None
+    if return_frame:
+        frame['fig'].canvas.draw()
+        rgba = np.array(frame['fig'].canvas.buffer_rgba())
+
+    if not reuse_figure:
+        plt.close(frame['fig'])
+    return rgba
+
+
+def make_figure(m, xx, yy, data, title, stats_str, stretch=None):
+    # build the map figure with all its static decorations; returns the artists
+    # that change between frames so draw_frame can update them
     # plotting stuff
     fig = plt.figure(figsize=(12, 6))
     ax = fig.add_subplot(111)
-    title = 'GRACE Land Water-Equivalent-Thickness Surface Mass Anomaly Rel 6.0 v 03 for dates: ' + \
-            os.path.splitext(os.path.basename(img_file))[0][6:21]
-            #img_file.split('/')[-1][6:21]
-    ax.set_title(title, loc='center', pad=22, color='white')
+    title_txt = ax.set_title(title, loc='center', pad=22, color='white')
 
-    # Note for future: it would be good if these were dynamic, but
-    # set for an entire AOI image stack, so that the legend doesn't
-    # change over time
-    stretch_min = -0.25
-    stretch_max = 0.25
+    # fixed stretch unless one was computed for the entire AOI image stack
+    # (see aoi_stretch), so that the legend doesn't change over time
+    stretch_min, stretch_max = stretch if stretch is not None else DEFAULT_STRETCH
 
     im = m.pcolormesh(xx,
                       yy,
@@ -137,7 +355,8 @@ def make_plot(img_file, o_dir, contrast_stretch, ul_coord, lr_coord):
                       cmap=plt.cm.plasma,
                       shading='auto',
                       vmin=stretch_min,
-                      vmax=stretch_max)
+                      vmax=stretch_max,
+                      ax=ax)
 
     fig.set_facecolor('black')
     ax.set_facecolor('black')
@@ -153,18 +372,16 @@ def make_plot(img_file, o_dir, contrast_stretch, ul_coord, lr_coord):
             for t in x[m][1]:
                 t.set_color(color)
 
-    m.drawcountries()
-    m.drawcoastlines(linewidth=.5)
-
-    stats_str = f'AOI Mean = {round(data.mean(), 2)} AOI STD DEV = {round(data.std(), 2)}'
+    m.drawcountries(ax=ax)
+    m.drawcoastlines(linewidth=.5, ax=ax)
 
-    plt.annotate(stats_str, xy=(10, 10), color='white')
+    stats_txt = ax.annotate(stats_str, xy=(10, 10), color='white')
     #plt.annotate(std_str, xy=(-1, -1), color='white')
 
     # for some reason getting lat/long labels to change color requires this funny trick
-    merid = m.drawmeridians(np.arange(0, 361, 20), labels=[0, 0, 0, 1], color='white')
+    merid = m.drawmeridians(np.arange(0, 361, 20), labels=[0, 0, 0, 1], color='white', ax=ax)
     setcolor(merid, 'white')
-    par = m.drawparallels(np.arange(-90, 91, 20), labels=[1, 0, 0, 1], color='white')
+    par = m.drawparallels(np.arange(-90, 91, 20), labels=[1, 0, 0, 1], color='white', ax=ax)
     setcolor(par, 'white')
 
     cb = m.colorbar(im, location='bottom', pad=0.5, ax=ax)
@@ -178,18 +395,26 @@ def make_plot(img_file, o_dir, contrast_stretch, ul_coord, lr_coord):
     import warnings
     warnings.filterwarnings('ignore')
 
-    cb.ax.set_xticks(np.round(np.arange(stretch_min, stretch_max + 0.1, 0.1)))
-    cb.ax.set_xticklabels(np.round(np.arange(stretch_min, stretch_max+0.1, 0.1), 2),
+    ticks = np.linspace(stretch_min, stretch_max, 6)
+    cb.ax.set_xticks(ticks)
+    cb.ax.set_xticklabels(np.round(ticks, 2),
                           color='white')
 
-    if not os.path.exists(o_dir):
-        os.makedirs(o_dir)
+    return {'fig': fig, 'ax': ax, 'im': im, 'title': title_txt, 'stats': stats_txt}
+
+
+def draw_frame(frame, data, title, stats_str):
+    # only the data layer and the text change between frames of the same AOI
+    frame['im'].set_array(data.ravel())
+    frame['title'].set_text(title)
+    frame['stats'].set_text(stats_str)
+
 
-    fig.savefig('{a}{b}_{c}_{d}.png'.format(a=o_dir + '/',
-                                            b=os.path.basename(img_file[:-4]),
-                                            c=str(ul_coord[0]) + 'N' + str(ul_coord[1]) + 'W_by',
-                                            d=str(lr_coord[0]) + 'N_' + str(lr_coord[1]) + 'W'))
-    plt.close(fig)
+def close_figures():
+    # release the figures kept by reuse_figure
+    for frame in FIGURE_CACHE.values():
+        plt.close(frame['fig'])
+    FIGURE_CACHE.clear()
 
 
 if __name__ == '__main__':
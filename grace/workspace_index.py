@@ -0,0 +1,103 @@
+"""This module builds a date index of the rasters in a workspace, so that finding the file(s)
+for a given date is a dict lookup instead of a fresh glob over the directory."""
+
+import os
+import re
+import json
+from datetime import datetime
+
+INDEX_NAME = '.raster_index.json'
+
+# one pattern per product family, mirroring the globs in time_series_aoi.make_prod_list
+# GRD-3_2002091-2002120_GRAC_JPLEM_BA01_0600_LND_v03.tif -> start date 2002091
+GRD3_PATTERN = re.compile(r'_(\d{4})(\d{3})')
+# MCD43A3.A2019001.h12v04.006.2019010123456.tif -> acquisition date 2019001
+MODIS_PATTERN = re.compile(r'\.A(\d{4})(\d{3})\.')
+# LC08_L1TP_042034_20190601_20190618_01_T1.h5 -> acquisition date 20190601
+LC08_PATTERN = re.compile(r'_(\d{4})(\d{2})(\d{2})_')
+
+
+def parse_file_dates(file_name):
+    # return every yyyyddd key the file name is valid for, [] if it is not a known product
+    keys = []
+    if file_name.startswith('GRD-3') and file_name.endswith('.tif'):
+        keys = [year + day for year, day in GRD3_PATTERN.findall(file_name)]
+    elif ('MCD' in file_name or 'VNP' in file_name or 'VJ1' in file_name) and file_name.endswith('.tif'):
+        keys = [year + day for year, day in MODIS_PATTERN.findall(file_name)]
+    elif 'LC08' in file_name and os.path.splitext(file_name)[1].startswith('.h'):
+        for year, month, day in LC08_PATTERN.findall(file_name):
+            try:
+                keys.append(datetime.strptime(year + month + day, '%Y%m%d').strftime('%Y%j'))
+            except ValueError:
+                pass
+
+    # drop anything that looks like a date but isn't, e.g. DOY 000 or 367
+    return [key for key in keys if 1 <= int(key[4:]) <= 366]
+
+
+def scan_dir(in_dir):
+    # single pass over the directory, parsing every product pattern at once
+    files = {}
+    for file_name in sorted(os.listdir(in_dir)):
+        for key in parse_file_dates(file_name):
+            files.setdefault(key, []).append(file_name)
+    return files
+
+
+def build_index(in_dir, persist=True):
+    # return a dict mapping yyyyddd -> list of file names in in_dir.
+    # The index is kept in a sidecar file and only rebuilt when the directory mtime
+    # changes, i.e. when a file was added, removed or renamed.
+    index_path = os.path.join(in_dir, INDEX_NAME)
+    dir_mtime = os.stat(in_dir).st_mtime_ns
+
+    if persist and os.path.isfile(index_path):
+        try:
+            with open(index_path, 'r') as f:
+                sidecar = json.load(f)
+            if sidecar.get('mtime') == dir_mtime:
+                return sidecar['files']
+        except (ValueError, KeyError):
+            print('Raster index is corrupt, rebuilding it.')
+
+    # creating the sidecar itself bumps the directory mtime, so make sure it exists first.
+    # The mtime is read before scanning: a file added during the scan then leaves the
+    # sidecar with an older mtime than the directory, and the next call rescans.
+    writable = persist
+    if persist and not os.path.isfile(index_path):
+        try:
+            open(index_path, 'w').close()
+        except OSError:
+            writable = False
+    dir_mtime = os.stat(in_dir).st_mtime_ns
+
+    files = scan_dir(in_dir)
+
+    if writable:
+        # rewriting the existing sidecar in place does not change the directory mtime
+        try:
+            with open(index_path, 'w') as f:
+                json.dump({'mtime': dir_mtime, 'files': files}, f)
+        except OSError:
+            writable = False
+    if persist and not writable:
+        print(f'Could not write raster index to {in_dir}, continuing without it.')
+
+    return files
+
+
+def lookup(index, in_dir, prdct, year, day):
+    # return full paths of the prdct files for the date, same result as the old glob
+    return [os.path.join(in_dir, file_name)
+            for file_name in index.get(str(year) + str(day), [])
+            if file_name.startswith(prdct)]
+
+
+def dates_in_range(index, prdct, start_date, end_date):
+    # return the sorted yyyyddd keys that have a prdct file between the two dates (inclusive),
+    # so callers iterate over the files that exist rather than over every calendar day
+    start_key = start_date.strftime('%Y%j')
+    end_key = end_date.strftime('%Y%j')
+    return sorted(key for key, file_names in index.items()
+                  if start_key <= key <= end_key
+                  and any(file_name.startswith(prdct) for file_name in file_names))
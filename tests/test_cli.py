@@ -0,0 +1,76 @@
+"""Job files and their translation to command line arguments."""
+
+import json
+
+import pytest
+
+from grace import cli
+
+
+def parse_job(job):
+    return cli.make_parser().parse_args(cli.job_to_argv(job))
+
+
+def test_bool_flags():
+    job = {'task': 'download', 'workspace': '/data', 'start': '2002-01-01', 'end': '2020-12-01',
+           'sync': True, 'revalidate': False}
+    assert cli.job_to_argv(job) == ['download', '--workspace', '/data', '--start', '2002-01-01',
+                                    '--end', '2020-12-01', '--sync']
+    args = parse_job(job)
+    assert args.sync and not args.revalidate and not args.cube
+
+
+def test_repeated_box():
+    job = {'task': 'pipeline', 'workspace': '/data', 'start': '2002-01-01', 'end': '2020-12-01',
+           'box': [[-10, 100, -45, 160], [60, -120, 30.5, -90]]}
+    assert parse_job(job).box == [[-10, 100, -45, 160], [60, -120, 30.5, -90]]
+
+
+def test_csv_list_or_scalar():
+    job = {'task': 'timeseries', 'workspace': '/data', 'start': '2002-01-01', 'end': '2018-12-31'}
+    assert parse_job(dict(job, csv='AliceSprings.csv')).csv == ['AliceSprings.csv']
+    assert parse_job(dict(job, csv=['a.csv', 'b.csv'])).csv == ['a.csv', 'b.csv']
+
+
+def test_coords_and_underscored_options():
+    job = {'task': 'map', 'workspace': '/data', 'ul': [-10, 100], 'lr': [-45.5, 160],
+           'use_cube': True, 'dynamic_stretch': True}
+    args = parse_job(job)
+    assert args.ul == [-10, 100] and args.lr == [-45.5, 160]
+    assert args.use_cube and args.dynamic_stretch and not args.in_memory
+
+
+def test_read_job_file_shapes(tmp_path):
+    job = {'task': 'download', 'workspace': '/data', 'start': '2002-01-01', 'end': '2020-12-01'}
+    single = tmp_path / 'single.json'
+    single.write_text(json.dumps(job))
+    listed = tmp_path / 'listed.json'
+    listed.write_text(json.dumps({'jobs': [job, job]}))
+    assert cli.read_job_file(str(single)) == [job]
+    assert cli.read_job_file(str(listed)) == [job, job]
+
+
+def test_read_yaml_job_file(tmp_path):
+    pytest.importorskip('yaml')
+    job_file = tmp_path / 'job.yaml'
+    job_file.write_text('jobs:\n'
+                        '  - task: timeseries\n'
+                        '    workspace: /data\n'
+                        '    start: "2002-01-01"\n'
+                        '    end: "2018-12-31"\n'
+                        '    csv: [AliceSprings.csv]\n')
+    assert cli.read_job_file(str(job_file))[0]['csv'] == ['AliceSprings.csv']
+
+
+def test_nested_run_is_rejected(tmp_path, monkeypatch):
+    ran = []
+    monkeypatch.setitem(cli.TASKS, 'download', ran.append)
+    job_file = tmp_path / 'job.json'
+    job_file.write_text(json.dumps({'jobs': [
+        {'task': 'download', 'workspace': '/data', 'start': '2002-01-01', 'end': '2020-12-01'},
+        {'task': 'run', 'job_file': str(job_file)}]}))
+
+    with pytest.raises(SystemExit, match='cannot run other job files'):
+        cli.main(['run', str(job_file)])
+    # nothing runs before the job file is rejected
+    assert ran == []
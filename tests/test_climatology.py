@@ -0,0 +1,47 @@
+"""Day of year / month x year matrices and the statistics over them."""
+
+import numpy as np
+
+from grace import climatology
+
+
+def test_leap_years_align_on_the_calendar():
+    # Feb 28, Feb 29 and Mar 1 of a leap year, Feb 28 and Mar 1 of a common year
+    keys = ['2004059', '2004060', '2004061', '2005059', '2005060']
+    matrix, years = climatology.doy_year_matrix(keys, [1.0, 2.0, 3.0, 4.0, 5.0])
+    assert matrix.shape == (366, 2)
+    assert list(years) == [2004, 2005]
+    assert list(matrix[58]) == [1.0, 4.0]
+    # common years leave the Feb 29 row empty
+    assert matrix[59, 0] == 2.0 and np.isnan(matrix[59, 1])
+    assert list(matrix[60]) == [3.0, 5.0]
+    # Dec 31 is the last row in both kinds of year
+    assert climatology.doy_positions(['2004366', '2005365'])[1].tolist() == [365, 365]
+
+
+def test_climatology_and_anomaly_for_many_sites():
+    keys = ['2010015', '2011015', '2012015', '2010046']
+    values = np.array([[1.0, 2.0, 3.0, 10.0],
+                       [np.nan, 4.0, 8.0, np.nan]])
+    matrix, years = climatology.month_year_matrix(keys, values)
+    assert matrix.shape == (2, 12, 3)
+
+    clim = climatology.climatology(matrix)
+    assert clim['mean'][0, 0] == 2.0 and clim['mean'][1, 0] == 6.0
+    assert clim['count'][0, 0] == 3 and clim['count'][1, 0] == 2
+    assert np.isclose(clim['std'][0, 0], np.std([1.0, 2.0, 3.0]))
+    assert clim['p50'][0, 0] == 2.0
+    # months without data are NaN with a count of 0
+    assert clim['count'][0, 5] == 0 and np.isnan(clim['mean'][0, 5]) and np.isnan(clim['p90'][0, 5])
+
+    anomaly = climatology.series_anomaly(keys, values)
+    assert anomaly.shape == values.shape
+    assert list(anomaly[0]) == [-1.0, 0.0, 1.0, 0.0]
+    assert anomaly[1, 1] == -2.0 and np.isnan(anomaly[1, 0])
+
+
+def test_years_frame_drops_empty_years():
+    years_df = climatology.years_frame(['2010001', '2011001'], [1.0, np.nan])
+    assert list(years_df.columns) == ['2010']
+    assert years_df.index[0] == 1 and len(years_df) == 366
+    assert climatology.years_frame(['2010001'], [np.nan]).empty
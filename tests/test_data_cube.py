@@ -0,0 +1,66 @@
+"""Data cube staleness against the rasters in the workspace."""
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip('osgeo.gdal')
+from grace import data_cube
+from grace import time_series_aoi
+
+JAN = 'GRD-3_2010001-2010031_GRAC_JPLEM_BA01_0600_LND_v03.tif'
+FEB = 'GRD-3_2010032-2010059_GRAC_JPLEM_BA01_0600_LND_v03.tif'
+GT = (-180.0, 0.5, 0.0, 90.0, 0.0, -0.5)
+
+
+def write_tif(path, value):
+    ds = gdal.GetDriverByName('GTiff').Create(str(path), 8, 4, 1, gdal.GDT_Float32)
+    ds.SetGeoTransform(GT)
+    ds.GetRasterBand(1).WriteArray(np.full((4, 8), value, dtype=np.float32))
+    ds = None
+
+
+@pytest.fixture(autouse=True)
+def clear_cubes():
+    yield
+    for cube_path in list(data_cube.CUBE_CACHE):
+        data_cube.close_cube(cube_path)
+
+
+def test_added_raster_makes_the_cube_stale(tmp_path):
+    write_tif(tmp_path / JAN, 1.0)
+    data_cube.build_cube(str(tmp_path))
+    cube, meta = data_cube.open_cube(str(tmp_path))
+    assert meta['files'] == [JAN]
+
+    # a month added without rebuilding the cube, e.g. a download without --cube
+    data_cube.close_cube(data_cube.cube_paths(str(tmp_path))[0])
+    write_tif(tmp_path / FEB, 2.0)
+    assert data_cube.open_cube(str(tmp_path)) is None
+
+    sites = [(np.array([89.0]), np.array([-179.0]))]
+    date_keys, matrices = time_series_aoi.extract_aois(str(tmp_path), 'GRD-3', datetime(2010, 1, 1),
+                                                       datetime(2010, 12, 31), sites, use_cube=True,
+                                                       use_cache=False)
+    assert date_keys == ['2010001', '2010032']
+    assert matrices[0].tolist() == [[1.0, 2.0]]
+
+    # rebuilding picks the new month up
+    data_cube.build_cube(str(tmp_path))
+    cube, meta = data_cube.open_cube(str(tmp_path))
+    assert meta['files'] == [JAN, FEB]
+
+
+def test_stale_result_is_remembered(tmp_path, capsys):
+    write_tif(tmp_path / JAN, 1.0)
+    data_cube.build_cube(str(tmp_path))
+    data_cube.close_cube(data_cube.cube_paths(str(tmp_path))[0])
+    os.remove(tmp_path / JAN)
+    write_tif(tmp_path / FEB, 2.0)
+    capsys.readouterr()
+
+    for i in range(3):
+        assert data_cube.open_cube(str(tmp_path)) is None
+    assert capsys.readouterr().out.count('out of date') == 1
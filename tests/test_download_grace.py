@@ -0,0 +1,223 @@
+"""Download engine against a local http.server stand-in for the JPL drive."""
+
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from grace import download_grace
+
+# two GRACE months, so only the GRAC url is ever asked for
+START = datetime(2010, 1, 1)
+END = datetime(2010, 3, 1)
+JAN = 'GRD-3_2010001-2010031_GRAC_JPLEM_BA01_0600_LND_v03.tif'
+FEB = 'GRD-3_2010032-2010059_GRAC_JPLEM_BA01_0600_LND_v03.tif'
+
+
+def tif_bytes(seed):
+    return bytes((seed + i) % 256 for i in range(4 * download_grace.MIN_TIF_SIZE))
+
+
+class TileServer:
+    # serves files from a dict, honouring Range/If-Range and If-None-Match like the drive,
+    # and logs (file name, request headers) for every GET. status overrides the answer
+    # for a file name, e.g. {JAN: 403}, and truncate cuts its body
+    # short at that byte while Content-Range still claims the whole file.
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.status = {}
+        self.truncate = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                name = self.path.rsplit('/', 1)[-1]
+                server.requests.append((name, dict(self.headers)))
+                body = server.files.get(name)
+                status = server.status.get(name, 200 if body is not None else 404)
+                if status != 200:
+                    self.send_response(status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                etag = f'"{name}-{len(body)}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                offset = 0
+                range_header = self.headers.get('Range')
+                if range_header and self.headers.get('If-Range', etag) == etag:
+                    offset = int(range_header.split('=')[1].rstrip('-'))
+                self.send_response(206 if offset else 200)
+                self.send_header('Content-Type', 'image/tiff')
+                end = server.truncate.get(name, len(body))
+                self.send_header('Content-Length', str(end - offset))
+                if offset:
+                    self.send_header('Content-Range', f'bytes {offset}-{len(body) - 1}/{len(body)}')
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body[offset:end])
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def names(self):
+        return [name for name, headers in self.requests]
+
+
+@pytest.fixture
+def server():
+    server = TileServer({JAN: tif_bytes(1), FEB: tif_bytes(2)})
+    server.thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+def download(server, dl_dir, **kwargs):
+    download_grace.dl_data(str(dl_dir), START, END, max_workers=2,
+                           base_url_grac=server.url, base_url_grfo=server.url, **kwargs)
+
+
+def test_plain_fetch(server, tmp_path):
+    download(server, tmp_path)
+    assert (tmp_path / JAN).read_bytes() == server.files[JAN]
+    assert (tmp_path / FEB).read_bytes() == server.files[FEB]
+    assert not list(tmp_path.glob('*.part'))
+
+
+def etag(server, name):
+    return f'"{name}-{len(server.files[name])}"'
+
+
+def write_part(tmp_path, name, data, etag):
+    (tmp_path / (name + '.part')).write_bytes(data)
+    (tmp_path / (name + '.part.json')).write_text(json.dumps({'etag': etag, 'last_modified': None}))
+
+
+def test_resume_partial_file(server, tmp_path):
+    write_part(tmp_path, JAN, server.files[JAN][:500], etag(server, JAN))
+    download(server, tmp_path, sync=True)
+
+    assert (tmp_path / JAN).read_bytes() == server.files[JAN]
+    jan_headers = [headers for name, headers in server.requests if name == JAN]
+    assert jan_headers[0]['Range'] == 'bytes=500-'
+    assert jan_headers[0]['If-Range'] == etag(server, JAN)
+    assert not list(tmp_path.glob('*.part*'))
+
+
+def test_resume_after_upstream_change(server, tmp_path):
+    # the partial file was started from an older version of the month
+    old_etag = etag(server, JAN)
+    write_part(tmp_path, JAN, tif_bytes(9)[:500], old_etag)
+    server.files[JAN] = tif_bytes(5) + b'x'
+    download(server, tmp_path, sync=True)
+
+    # If-Range doesn't match, so the whole new file comes back instead of the rest of it
+    assert (tmp_path / JAN).read_bytes() == server.files[JAN]
+    manifest = download_grace.read_manifest(str(tmp_path))
+    assert manifest[JAN]['md5'] == hashlib.md5(server.files[JAN]).hexdigest()
+
+
+def test_partial_file_without_validator_is_refetched(server, tmp_path):
+    (tmp_path / (JAN + '.part')).write_bytes(tif_bytes(9)[:500])
+    download(server, tmp_path, sync=True)
+
+    assert (tmp_path / JAN).read_bytes() == server.files[JAN]
+    assert 'Range' not in dict(server.requests)[JAN]
+
+
+def test_short_download_is_not_recorded(server, tmp_path):
+    # the resumed range comes back shorter than the total in Content-Range
+    write_part(tmp_path, JAN, server.files[JAN][:500], etag(server, JAN))
+    server.truncate[JAN] = 1000
+    download(server, tmp_path, sync=True)
+    assert JAN not in download_grace.read_manifest(str(tmp_path))
+    assert not os.path.exists(tmp_path / JAN)
+    assert (tmp_path / (JAN + '.part')).stat().st_size == 1000
+
+    del server.truncate[JAN]
+    server.requests.clear()
+    download(server, tmp_path, sync=True)
+    assert (tmp_path / JAN).read_bytes() == server.files[JAN]
+    assert dict(server.requests)[JAN]['Range'] == 'bytes=1000-'
+
+
+def test_complete_months_are_skipped(server, tmp_path):
+    download(server, tmp_path, sync=True)
+    server.requests.clear()
+
+    # the manifest says both months are complete, so nothing is asked for
+    download(server, tmp_path, sync=True)
+    assert server.requests == []
+
+    # revalidation asks with the etag and the server answers 304
+    download(server, tmp_path, sync=True, revalidate=True)
+    assert sorted(server.names()) == [JAN, FEB]
+    assert all('If-None-Match' in headers for name, headers in server.requests)
+    assert (tmp_path / JAN).read_bytes() == server.files[JAN]
+
+
+def test_only_new_files_are_flagged(server, tmp_path):
+    def flags():
+        downloads = download_grace.iter_downloads(str(tmp_path), START, END, max_workers=2,
+                                                  base_url_grac=server.url, base_url_grfo=server.url,
+                                                  sync=True)
+        return {os.path.basename(file_path): is_new for done, total, file_path, is_new in downloads}
+
+    assert flags() == {JAN: True, FEB: True}
+    # complete months are still yielded, but not as new
+    assert flags() == {JAN: False, FEB: False}
+
+
+def test_missing_month_is_recorded(server, tmp_path):
+    del server.files[FEB]
+    download(server, tmp_path, sync=True)
+
+    manifest = download_grace.read_manifest(str(tmp_path))
+    assert manifest[FEB] == {'missing': True}
+    assert not os.path.exists(tmp_path / FEB)
+
+    # a cached gap is not asked for again
+    server.requests.clear()
+    download(server, tmp_path, sync=True)
+    assert FEB not in server.names()
+
+
+@pytest.mark.parametrize('status', [401, 403, 429, 500])
+def test_failed_request_is_retried(server, tmp_path, status):
+    server.status[FEB] = status
+    download(server, tmp_path, sync=True)
+    assert FEB not in download_grace.read_manifest(str(tmp_path))
+
+    del server.status[FEB]
+    download(server, tmp_path, sync=True)
+    assert (tmp_path / FEB).read_bytes() == server.files[FEB]
+
+
+def test_unsatisfiable_range_restarts(server, tmp_path):
+    write_part(tmp_path, JAN, server.files[JAN][:500], etag(server, JAN))
+    server.status[JAN] = 416
+    download(server, tmp_path, sync=True)
+    assert not list(tmp_path.glob('*.part*'))
+    assert JAN not in download_grace.read_manifest(str(tmp_path))
+
+    # the next run fetches the whole file
+    del server.status[JAN]
+    server.requests.clear()
+    download(server, tmp_path, sync=True)
+    assert (tmp_path / JAN).read_bytes() == server.files[JAN]
+    assert 'Range' not in dict(server.requests)[JAN]
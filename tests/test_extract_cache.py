@@ -0,0 +1,75 @@
+"""Invalidation, eviction and sharing of the extraction cache."""
+
+import os
+
+import numpy as np
+
+from grace import extract_cache
+
+LATS = np.array([-23.7, -24.1])
+LONS = np.array([133.9, 134.2])
+
+
+def make_raster(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'tif')
+    return str(path)
+
+
+def test_hit_and_changed_file(tmp_path):
+    raster = make_raster(tmp_path, 'a.tif')
+    key = extract_cache.sites_hash(LATS, LONS)
+    cache = extract_cache.open_cache(str(tmp_path))
+    assert extract_cache.get_values(cache, raster, key) is None
+
+    extract_cache.put_values(cache, raster, key, [1.5, np.nan])
+    values = extract_cache.get_values(cache, raster, key)
+    assert values[0] == 1.5 and np.isnan(values[1])
+
+    # other sites are a different entry
+    assert extract_cache.get_values(cache, raster, extract_cache.sites_hash(LATS[:1], LONS[:1])) is None
+
+    # a re-downloaded file (new size and mtime) is a miss until it is stored again
+    with open(raster, 'ab') as f:
+        f.write(b'more')
+    os.utime(raster, ns=(1, 1))
+    assert extract_cache.get_values(cache, raster, key) is None
+    extract_cache.put_values(cache, raster, key, [2.0, 3.0])
+    assert list(extract_cache.get_values(cache, raster, key)) == [2.0, 3.0]
+    extract_cache.close_cache(cache)
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    key = extract_cache.sites_hash(LATS, LONS)
+    rasters = [make_raster(tmp_path, f'{i}.tif') for i in range(3)]
+    cache = extract_cache.open_cache(str(tmp_path))
+    for raster in rasters:
+        extract_cache.put_values(cache, raster, key, [0.0, 0.0])
+    extract_cache.close_cache(cache)
+
+    # reading the first one makes the second the least recently used
+    cache = extract_cache.open_cache(str(tmp_path))
+    extract_cache.get_values(cache, rasters[0], key)
+    extract_cache.close_cache(cache, max_bytes=2 * 16)
+
+    cache = extract_cache.open_cache(str(tmp_path))
+    assert extract_cache.get_values(cache, rasters[0], key) is not None
+    assert extract_cache.get_values(cache, rasters[1], key) is None
+    assert extract_cache.get_values(cache, rasters[2], key) is not None
+    extract_cache.close_cache(cache)
+
+
+def test_two_runs_share_the_cache(tmp_path):
+    raster = make_raster(tmp_path, 'a.tif')
+    key = extract_cache.sites_hash(LATS, LONS)
+    first = extract_cache.open_cache(str(tmp_path))
+    second = extract_cache.open_cache(str(tmp_path))
+
+    extract_cache.put_values(first, raster, key, [1.0, 2.0])
+    # a hit in one run doesn't hold a lock the other run's writes wait on
+    assert extract_cache.get_values(first, raster, key) is not None
+    extract_cache.put_values(second, make_raster(tmp_path, 'b.tif'), key, [3.0, 4.0])
+    assert extract_cache.get_values(second, raster, key) is not None
+
+    extract_cache.close_cache(first)
+    extract_cache.close_cache(second)
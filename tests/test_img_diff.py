@@ -0,0 +1,32 @@
+"""Date pairing for the batch image differences."""
+
+import pytest
+
+pytest.importorskip('osgeo')
+pytest.importorskip('mpl_toolkits.basemap')
+from grace import img_diff
+
+# month starts 2010-01 .. 2011-03, with 2010-06 missing
+KEYS = ['2010001', '2010032', '2010060', '2010091', '2010121', '2010182', '2010213', '2010244',
+        '2010274', '2010305', '2010335', '2011001', '2011032', '2011060']
+
+
+def test_month_pairs_skip_gaps():
+    pairs = img_diff.make_date_pairs(KEYS, rule='month')
+    assert pairs[0] == ('2010001', '2010032')
+    # no May -> June or June -> July pair across the gap
+    assert ('2010121', '2010182') not in pairs
+    assert ('2010335', '2011001') in pairs
+    # 13 steps between the 14 months, less the May -> July step across the gap
+    assert len(pairs) == 12
+
+
+def test_year_pairs_match_months():
+    assert img_diff.make_date_pairs(KEYS, rule='year') == [('2010001', '2011001'),
+                                                           ('2010032', '2011032'),
+                                                           ('2010060', '2011060')]
+
+
+def test_unknown_rule():
+    with pytest.raises(ValueError):
+        img_diff.make_date_pairs(KEYS, rule='week')
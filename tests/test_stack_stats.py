@@ -0,0 +1,59 @@
+"""Streaming stack statistics and their merge."""
+
+import numpy as np
+
+from grace import stack_stats
+
+
+def stats_of(*frames):
+    stats = stack_stats.new_stats()
+    for frame in frames:
+        stats = stack_stats.update_stats(stats, frame)
+    return stats
+
+
+def test_merge_matches_one_pass():
+    rng = np.random.default_rng(0)
+    frames = [rng.normal(i, 1 + i, (40, 50)) for i in range(6)]
+    merged = stack_stats.merge_stats(stats_of(*frames[:2]), stats_of(*frames[2:]))
+
+    values = np.concatenate([frame.ravel() for frame in frames])
+    assert merged['count'] == values.size
+    assert np.isclose(merged['mean'], values.mean())
+    assert np.isclose(merged['m2'] / merged['count'], values.var())
+    assert merged['min'] == values.min() and merged['max'] == values.max()
+
+
+def test_merge_with_empty():
+    stats = stats_of(np.arange(10.0))
+    assert stack_stats.merge_stats(stack_stats.new_stats(), stats)['count'] == 10
+    assert stack_stats.merge_stats(stats, stack_stats.new_stats())['mean'] == 4.5
+
+
+def test_nodata_is_ignored():
+    frame = np.ma.masked_array([1.0, 2.0, 3.0, 99.0], mask=[0, 0, 0, 1])
+    stats = stats_of(frame, np.array([np.nan, 4.0]))
+    assert stats['count'] == 4 and stats['max'] == 4.0
+
+
+def test_summary_stays_bounded_and_accurate():
+    rng = np.random.default_rng(1)
+    frames = [rng.uniform(0, 100, 5000) for i in range(200)]
+    stats = stats_of(*frames)
+    assert len(stats['q_values']) == stack_stats.SUMMARY_POINTS
+
+    values = np.concatenate(frames)
+    for q in (2, 50, 98):
+        assert abs(stack_stats.stats_percentile(stats, q) - np.percentile(values, q)) < 1.0
+
+
+def test_no_stretch_without_spread():
+    # an all-NoData AOI, e.g. all ocean in the land product
+    empty = stack_stats.summarize(stats_of(np.full((4, 4), np.nan)))
+    assert empty['count'] == 0
+    assert stack_stats.stretch_from_stats(empty) is None
+    assert stack_stats.stretch_from_stats(empty, symmetric=True) is None
+
+    flat = stack_stats.summarize(stats_of(np.full((4, 4), 3.0)))
+    assert stack_stats.stretch_from_stats(flat) is None
+    assert stack_stats.stretch_from_stats(flat, symmetric=True) == (-3.0, 3.0)
@@ -0,0 +1,58 @@
+"""Per site time series files written by write_time_series and read back by read_time_series."""
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('osgeo')
+from grace import time_series_aoi
+
+SITE_IDS = ['001', '002', 'ridge']
+DATE_KEYS = ['2010001', '2010032', '2011001']
+SITE_MATRIX = np.array([[1.5, np.nan, 2.0],
+                        [-3.0, 4.25, np.nan],
+                        [np.nan, np.nan, np.nan]])
+
+
+@pytest.fixture
+def per_site_csv(tmp_path, monkeypatch):
+    # only the files are checked here, not the graphs
+    monkeypatch.setattr(time_series_aoi, 'overpost_all_plot', lambda *args: None)
+    monkeypatch.setattr(time_series_aoi, 'box_plot', lambda *args: None)
+    time_series_aoi.write_time_series(str(tmp_path), 'GRD-3', datetime(2010, 1, 1), datetime(2011, 12, 31),
+                                      'Ridge.csv', SITE_IDS, DATE_KEYS, SITE_MATRIX)
+    csvs = [name for name in os.listdir(tmp_path / 'graphs') if name.endswith('_per_site.csv')]
+    assert len(csvs) == 1
+    return str(tmp_path / 'graphs' / csvs[0])
+
+
+def check_frame(site_df):
+    assert isinstance(site_df.index, pd.DatetimeIndex)
+    assert list(site_df.index) == list(pd.to_datetime(DATE_KEYS, format='%Y%j'))
+    assert list(site_df.columns) == SITE_IDS
+    assert all(dtype == np.float64 for dtype in site_df.dtypes)
+    np.testing.assert_array_equal(site_df.to_numpy(), SITE_MATRIX.T)
+
+
+def test_per_site_csv_reads_back_typed(per_site_csv):
+    check_frame(time_series_aoi.read_time_series(per_site_csv))
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_columnar_round_trip(tmp_path, per_site_csv, fmt):
+    pytest.importorskip('pyarrow')
+    out_path = str(tmp_path / ('per_site.' + fmt))
+    assert time_series_aoi.write_columnar(SITE_IDS, DATE_KEYS, SITE_MATRIX, out_path, fmt) == out_path
+
+    site_df = time_series_aoi.read_time_series(out_path)
+    check_frame(site_df)
+    # the same frame as the csv fallback gives
+    pd.testing.assert_frame_equal(site_df, time_series_aoi.read_time_series(per_site_csv), check_freq=False)
+
+
+def test_unknown_columnar_format(tmp_path):
+    with pytest.raises(ValueError):
+        time_series_aoi.write_columnar(SITE_IDS, DATE_KEYS, SITE_MATRIX, str(tmp_path / 'x.orc'), 'orc')
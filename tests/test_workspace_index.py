@@ -0,0 +1,37 @@
+"""Date parsing and the persisted raster index."""
+
+import os
+
+from grace import workspace_index
+
+
+def test_parse_grace_dates():
+    name = 'GRD-3_2002091-2002120_GRAC_JPLEM_BA01_0600_LND_v03.tif'
+    assert workspace_index.parse_file_dates(name) == ['2002091']
+
+
+def test_parse_other_products():
+    assert workspace_index.parse_file_dates('MCD43A3.A2019001.h12v04.006.2019010123456.tif') == ['2019001']
+    assert workspace_index.parse_file_dates('LC08_L1TP_042034_20190601_20190618_01_T1.h5') == ['2019152']
+
+
+def test_parse_rejects_unknown_and_bad_dates():
+    assert workspace_index.parse_file_dates('notes.txt') == []
+    assert workspace_index.parse_file_dates('GRD-3_2002091-2002120_GRAC_v03.png') == []
+    assert workspace_index.parse_file_dates('GRD-3_2002000-2002367_GRAC_v03.tif') == []
+    assert workspace_index.parse_file_dates('LC08_L1TP_042034_20190231_01_T1.h5') == []
+
+
+def test_index_sees_added_files(tmp_path):
+    jan = 'GRD-3_2010001-2010031_GRAC_JPLEM_BA01_0600_LND_v03.tif'
+    feb = 'GRD-3_2010032-2010059_GRAC_JPLEM_BA01_0600_LND_v03.tif'
+    (tmp_path / jan).write_bytes(b'')
+    index = workspace_index.build_index(str(tmp_path))
+    assert index['2010001'] == [jan]
+    assert os.path.isfile(tmp_path / workspace_index.INDEX_NAME)
+
+    # unchanged directory: served from the sidecar
+    assert workspace_index.build_index(str(tmp_path)) == index
+
+    (tmp_path / feb).write_bytes(b'')
+    assert workspace_index.build_index(str(tmp_path))['2010032'] == [feb]